@@ -1,9 +1,25 @@
 import os
-from google.cloud import bigquery
-from vertexai.preview.generative_models import GenerativeModel
-import vertexai
+import argparse
+import base64
+import bisect
+import json
+import hashlib
+import queue
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
 from datetime import datetime, timedelta
 import time  # Agregar esta importación
+import random
+import threading
+import unicodedata
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 # Configuración (Reemplaza con tus valores)
 PROJECT_ID = "website-401719"
@@ -12,6 +28,185 @@ BQ_INPUT_TABLE = "Info"
 BQ_OUTPUT_TABLE = "info_detalle"
 MODEL_NAME = "gemini-pro"
 VERTEX_AI_LOCATION = "us-central1"
+# Configuración de generación que se envía al modelo (None = valores por defecto)
+GENERATION_CONFIG = None
+
+# Modo incremental: por defecto se conserva info_detalle y solo se analizan los
+# registros de Info que todavía no tienen análisis. Con True se borra y se
+# recrea la tabla y se vuelve a analizar todo
+FULL_REBUILD = False
+
+# Verificación de recursos: plazo para que la tabla de salida recién creada
+# responda y tiempo durante el que se recuerda una verificación correcta
+TABLE_READY_TIMEOUT_SECONDS = 30.0
+TABLE_READY_INITIAL_DELAY_SECONDS = 0.05
+RESOURCE_CHECK_TTL_SECONDS = 600
+
+# Número máximo de solicitudes a Gemini en vuelo al mismo tiempo
+MAX_CONCURRENT_REQUESTS = 8
+
+# Cuotas de Vertex AI del proyecto (solicitudes y tokens por minuto)
+VERTEX_REQUESTS_PER_MINUTE = 300
+VERTEX_TOKENS_PER_MINUTE = 300000
+# Fracción de la cuota que usamos, para mantenernos justo por debajo del límite
+QUOTA_SAFETY_FACTOR = 0.9
+# Tokens de salida que se reservan por llamada antes de conocer la respuesta
+ESTIMATED_OUTPUT_TOKENS = 1024
+
+# Control adaptativo de concurrencia (AIMD): la ventana arranca en
+# INITIAL_CONCURRENT_REQUESTS y se mueve entre MIN y max_concurrency
+INITIAL_CONCURRENT_REQUESTS = 4
+MIN_CONCURRENT_REQUESTS = 1
+# Latencia por llamada por encima de la cual se deja de crecer
+TARGET_MODEL_LATENCY_SECONDS = 20.0
+AIMD_INCREASE = 1.0
+AIMD_DECREASE_FACTOR = 0.5
+# Reintentos de una llamada al modelo rechazada por 429/503
+MAX_THROTTLE_RETRIES = 5
+
+# Escritura por lotes en info_detalle. insertAll admite hasta 10 MB por
+# solicitud; se deja margen para el envoltorio de la petición
+WRITE_BATCH_MAX_ROWS = 500
+WRITE_BATCH_MAX_BYTES = 9 * 1024 * 1024
+WRITE_BATCH_MAX_SECONDS = 5.0
+# Lotes pendientes de enviar antes de frenar a quien escribe, y cuántos hilos
+# los envían en paralelo
+WRITE_QUEUE_MAX_BATCHES = 4
+WRITE_WORKERS = 2
+
+# Reintentos de insertAll: espera exponencial con jitter entre intentos
+INSERT_MAX_RETRIES = 3
+INSERT_BASE_BACKOFF_SECONDS = 1.0
+INSERT_MAX_BACKOFF_SECONDS = 30.0
+# Motivos de error por fila que no se arreglan reintentando
+PERMANENT_INSERT_ERROR_REASONS = {"invalid"}
+# Archivo NDJSON donde se guardan las filas rechazadas de forma permanente
+DEAD_LETTER_FILE = os.path.join(tempfile.gettempdir(), "info_detalle_dead_letter.ndjson")
+
+# Caché persistente de respuestas del modelo (SQLite), con tope de tamaño
+# (se expulsan las entradas usadas hace más tiempo) y caducidad. En Cloud
+# Functions /tmp está en memoria y cuenta contra el límite de la instancia, así
+# que allí la caché solo se activa con INFOIA_RESPONSE_CACHE=1
+RUNNING_ON_CLOUD_FUNCTIONS = bool(os.environ.get("FUNCTION_TARGET") or os.environ.get("K_SERVICE"))
+RESPONSE_CACHE_ENABLED = (os.environ.get("INFOIA_RESPONSE_CACHE") == "1") if RUNNING_ON_CLOUD_FUNCTIONS else True
+RESPONSE_CACHE_FILE = os.path.join(tempfile.gettempdir(), "infoia_response_cache.sqlite3")
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+RESPONSE_CACHE_TTL_SECONDS = 30 * 24 * 3600
+
+# Deduplicación dentro de la ejecución: los registros cuyo Titulo/Comentario
+# coinciden tras normalizar se analizan una sola vez. Se recuerdan como mucho
+# DEDUP_MAX_RESULTS análisis ya terminados para los duplicados que lleguen tarde
+DEDUPLICATE_INPUTS = True
+DEDUP_MAX_RESULTS = 10000
+# Casi duplicados (MinHash/LSH, opcional): se reutiliza el análisis del
+# representante si la similitud de Jaccard estimada supera el umbral
+NEAR_DEDUP_THRESHOLD = None  # p. ej. 0.85; None lo desactiva
+MINHASH_NUM_PERM = 64
+MINHASH_SHINGLE_SIZE = 5
+
+# Prompts empaquetados: varios registros por llamada con respuesta JSON por Id.
+# El tamaño del paquete se ajusta a los presupuestos de tokens de entrada
+# (solo la parte variable) y de salida (ESTIMATED_OUTPUT_TOKENS por registro)
+PACK_RECORDS = False
+PACK_MAX_RECORDS = 10
+PACK_INPUT_TOKEN_BUDGET = 6000
+PACK_OUTPUT_TOKEN_BUDGET = 8192
+
+# Prefijo de instrucciones en caché: el bloque común se registra una vez como
+# contenido en caché de Vertex AI (o como system_instruction si no se puede) y
+# cada llamada envía solo la parte variable. Si nada de eso está disponible se
+# envían los prompts completos
+PREFIX_CACHING = True
+PREFIX_CACHE_TTL = timedelta(hours=1)
+# Un 400 solo apaga el prefijo si su mensaje apunta al contenido en caché o a
+# system_instruction; cualquier otro es un problema del registro y se propaga
+PREFIX_ERROR_MARKERS = ("cached_content", "cachedcontent", "cached content",
+                        "system_instruction", "systeminstruction", "system instruction")
+
+# Modo de generación: "online" (generate_content), "batch" (predicción por
+# lotes de Vertex AI, BigQuery de entrada y salida) o "auto", que usa lotes a
+# partir de BATCH_PREDICTION_ROW_THRESHOLD registros
+GENERATION_MODE = "auto"
+BATCH_PREDICTION_ROW_THRESHOLD = 20000
+# Prefijo de las tablas de staging del job por lotes (se borran al terminar)
+BQ_BATCH_TABLE_PREFIX = "info_batch"
+# Consulta del estado del job: espera exponencial entre consultas y plazo máximo
+BATCH_POLL_INITIAL_SECONDS = 30.0
+BATCH_POLL_MAX_SECONDS = 300.0
+BATCH_POLL_TIMEOUT_SECONDS = 24 * 3600
+
+# Lectura de Info por páginas: filas por página y páginas en memoria como máximo
+INPUT_PAGE_SIZE = 1000
+INPUT_QUEUE_MAX_PAGES = 4
+# Lector de entrada: "rest" (tabledata vía query_job.result) o "storage_api"
+# (BigQuery Storage Read API con Arrow; requiere google-cloud-bigquery-storage)
+INPUT_READER = "rest"
+INPUT_COLUMNS = ["Id", "Titulo", "Comentario"]
+# Streams de lectura en paralelo que se piden a la Storage Read API
+STORAGE_READ_MAX_STREAMS = 4
+
+# Cada cuántos segundos se imprime el estado de las etapas del pipeline
+PIPELINE_REPORT_SECONDS = 30.0
+
+# Métricas de la ejecución (latencia por etapa y contadores). Con METRICS_FILE
+# se exportan al terminar en METRICS_FORMAT: "json" (resumen de la ejecución),
+# "prometheus" (formato de texto) u "openmetrics"
+METRICS_FILE = None
+METRICS_FORMAT = "json"
+# Límites superiores (segundos) de los buckets de los histogramas de latencia
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Trazas de OpenTelemetry (opcional, requiere opentelemetry-sdk): None las
+# desactiva sin costo, "otlp" las envía a un colector OTLP/gRPC y "file" las
+# escribe como un JSON por línea en TRACING_FILE
+TRACING_EXPORTER = None
+TRACING_OTLP_ENDPOINT = "http://localhost:4317"
+TRACING_FILE = os.path.join(tempfile.gettempdir(), "infoia_traces.ndjson")
+
+# Diario de progreso (local, solo anexado) para reanudar ejecuciones
+# interrumpidas sin repetir los registros ya guardados
+CHECKPOINT_ENABLED = True
+CHECKPOINT_FILE = os.path.join(tempfile.gettempdir(), "infoia_checkpoint.ndjson")
+
+# Presupuesto de tiempo por invocación (Cloud Functions corta la ejecución al
+# llegar a su timeout, p. ej. 540 s). None lo desactiva. Al entrar en el margen
+# de vaciado se dejan de tomar registros, se esperan las llamadas en vuelo y
+# los lotes pendientes y se publica una continuación
+TIME_BUDGET_SECONDS = None
+DEADLINE_DRAIN_MARGIN_SECONDS = 60.0
+# Tema de Pub/Sub que vuelve a disparar la función con la continuación
+CONTINUATION_TOPIC = "infoia-continuacion"
+
+# Fragmentación horizontal: la tarea `SHARD_INDEX` de `SHARD_COUNT` solo
+# procesa los Id cuyo FARM_FINGERPRINT cae en su fragmento, sin coordinarse
+# con las demás. En un Cloud Run job se toman de las variables de la tarea
+SHARD_INDEX = int(os.environ.get("CLOUD_RUN_TASK_INDEX", "0"))
+SHARD_COUNT = int(os.environ.get("CLOUD_RUN_TASK_COUNT", "1"))
+
+# Cola de trabajo con arrendamientos (alternativa dinámica a los fragmentos):
+# los trabajadores reclaman lotes de Id y los renuevan mientras los procesan;
+# si un trabajador cae, otro reclama sus Id al vencer el arrendamiento. La
+# cola es un archivo SQLite: solo la comparten procesos de la misma máquina
+# (no las tareas de un Cloud Run job, cada una con su /tmp). Borra
+# WORK_QUEUE_FILE para empezar una cola nueva
+WORK_QUEUE_FILE = os.path.join(tempfile.gettempdir(), "infoia_work_queue.sqlite3")
+WORK_QUEUE_CLAIM_SIZE = 50
+WORK_QUEUE_LEASE_SECONDS = 300.0
+# Reclamos de un Id antes de darlo por fallido
+WORK_QUEUE_MAX_ATTEMPTS = 3
+# Espera entre consultas cuando solo quedan Id arrendados por otros
+WORK_QUEUE_POLL_SECONDS = 5.0
+# Procesos que comparten la cola y, con ella, la cuota del proyecto
+WORK_QUEUE_WORKERS = 1
+
+# Backend de salida: "streaming" (insertAll), "load_job" o "auto". En "auto"
+# se usan load jobs a partir de LOAD_JOB_ROW_THRESHOLD filas esperadas
+OUTPUT_BACKEND = "auto"
+LOAD_JOB_ROW_THRESHOLD = 50000
+# Tamaño de cada archivo NDJSON que se carga con un load job
+LOAD_JOB_MAX_BYTES = 256 * 1024 * 1024
+# Archivos preparados pendientes de cargar antes de frenar a quien escribe
+LOAD_JOB_MAX_PENDING_FILES = 2
 
 # Ruta CORRECTA al archivo JSON de credenciales de la cuenta de servicio
 CREDENTIALS_FILE = r"C:\traProyectos\banano\iaInfo\credentials.json" # ¡Archivo .json!
@@ -19,111 +214,1818 @@ CREDENTIALS_FILE = r"C:\traProyectos\banano\iaInfo\credentials.json" # ¡Archivo
 # Establecer la variable de entorno para las credenciales
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIALS_FILE
 
-# Inicializar clientes
-bq_client = bigquery.Client(project=PROJECT_ID)
-vertexai.init(project=PROJECT_ID, location=VERTEX_AI_LOCATION)
+# Los clientes se crean al primer uso y se reutilizan en invocaciones en
+# caliente; las bibliotecas de Google (lentas de importar) se importan entonces
+_bq_client = None
+_vertexai_initialized = False
+_client_lock = threading.Lock()
+_resources_verified_at = None
+
+def get_bq_client():
+    """Cliente de BigQuery compartido por el proceso"""
+    global _bq_client
+    if _bq_client is None:
+        with _client_lock:
+            if _bq_client is None:
+                from google.cloud import bigquery
+                _bq_client = bigquery.Client(project=PROJECT_ID)
+    return _bq_client
+
+def get_generative_model(model_name=MODEL_NAME, **kwargs):
+    """Crea un GenerativeModel, inicializando Vertex AI la primera vez"""
+    global _vertexai_initialized
+    from vertexai.preview.generative_models import GenerativeModel
+    if not _vertexai_initialized:
+        with _client_lock:
+            if not _vertexai_initialized:
+                import vertexai
+                vertexai.init(project=PROJECT_ID, location=VERTEX_AI_LOCATION)
+                _vertexai_initialized = True
+    return GenerativeModel(model_name, **kwargs)
+
+def wait_for_table(table_id, timeout=TABLE_READY_TIMEOUT_SECONDS, initial_delay=TABLE_READY_INITIAL_DELAY_SECONDS,
+                   clock=None):
+    """Espera a que get_table responda, con espera exponencial hasta el plazo"""
+    clock = clock or SystemClock()
+    deadline = clock.now() + timeout
+    delay = initial_delay
+    while True:
+        try:
+            return get_bq_client().get_table(table_id)
+        except Exception as e:
+            if clock.now() + delay > deadline:
+                raise Exception(f"No se puede acceder a la tabla después de crearla: {str(e)}")
+            clock.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+def verify_bigquery_resources(full_rebuild=FULL_REBUILD):
+    """Verifica la existencia y acceso a recursos de BigQuery.
 
-def verify_bigquery_resources():
-    """Verifica la existencia y acceso a recursos de BigQuery"""
+    Las consultas de metadatos independientes se hacen en paralelo y un
+    resultado positivo se recuerda RESOURCE_CHECK_TTL_SECONDS (salvo en
+    reconstrucción completa, que siempre borra y recrea la tabla de salida).
+    """
+    global _resources_verified_at
     try:
+        if (not full_rebuild and _resources_verified_at is not None
+                and time.monotonic() - _resources_verified_at < RESOURCE_CHECK_TTL_SECONDS):
+            print("✓ Recursos de BigQuery verificados recientemente")
+            return True
+
         # Verificar credenciales
         if not os.path.exists(CREDENTIALS_FILE):
             raise Exception(f"Archivo de credenciales no encontrado en: {CREDENTIALS_FILE}")
         
         print("✓ Credenciales verificadas")
         
-        # Verificar dataset
+        client = get_bq_client()
+        table_id = f"{PROJECT_ID}.{BQ_DATASET}.{BQ_OUTPUT_TABLE}"
+
+        # Verificar dataset, tabla de entrada y tabla de salida a la vez
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            dataset_check = executor.submit(client.get_dataset, f"{PROJECT_ID}.{BQ_DATASET}")
+            input_check = executor.submit(client.get_table, f"{PROJECT_ID}.{BQ_DATASET}.{BQ_INPUT_TABLE}")
+            output_check = None if full_rebuild else executor.submit(client.get_table, table_id)
+
         try:
-            dataset = bq_client.get_dataset(f"{PROJECT_ID}.{BQ_DATASET}")
+            dataset_check.result()
             print(f"✓ Dataset '{BQ_DATASET}' encontrado")
         except Exception:
             raise Exception(f"Dataset '{BQ_DATASET}' no encontrado o sin acceso")
         
-        # Verificar tabla de entrada
         try:
-            input_table = bq_client.get_table(f"{PROJECT_ID}.{BQ_DATASET}.{BQ_INPUT_TABLE}")
+            input_check.result()
             print(f"✓ Tabla de entrada '{BQ_INPUT_TABLE}' encontrada")
         except Exception:
             raise Exception(f"Tabla '{BQ_INPUT_TABLE}' no encontrada o sin acceso")
+
+        output_exists = False
+        if output_check is not None:
+            try:
+                output_check.result()
+                output_exists = True
+                print(f"✓ Tabla de salida '{BQ_OUTPUT_TABLE}' encontrada")
+            except Exception:
+                pass  # Se crea a continuación
         
-        # Crear o verificar tabla de salida
-        table_id = f"{PROJECT_ID}.{BQ_DATASET}.{BQ_OUTPUT_TABLE}"
-        
-        # Intentar eliminar la tabla si existe
-        try:
-            bq_client.delete_table(table_id)
-            print(f"Tabla existente '{BQ_OUTPUT_TABLE}' eliminada")
-        except Exception:
-            pass  # La tabla no existía, lo cual está bien
-        
-        # Crear nueva tabla
-        print(f"Creando tabla '{BQ_OUTPUT_TABLE}'...")
-        schema = [
-            bigquery.SchemaField("id_original", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("titulo", "STRING", mode="REQUIRED"),
-            bigquery.SchemaField("analisis", "STRING", mode="REQUIRED")
-        ]
-        
-        table = bigquery.Table(table_id, schema=schema)
-        table = bq_client.create_table(table, exists_ok=True)  # Cambiar a exists_ok=True
-        print(f"✓ Tabla '{BQ_OUTPUT_TABLE}' creada exitosamente")
-        
-        # Esperar a que la tabla esté disponible
-        print("Esperando a que la tabla esté disponible...")
-        time.sleep(5)  # Esperar 5 segundos
+        # En reconstrucción completa, intentar eliminar la tabla si existe
+        if full_rebuild:
+            try:
+                client.delete_table(table_id)
+                print(f"Tabla existente '{BQ_OUTPUT_TABLE}' eliminada")
+            except Exception:
+                pass  # La tabla no existía, lo cual está bien
         
-        # Verificar que la tabla existe y está accesible
-        try:
-            bq_client.get_table(table_id)
-            print("✓ Tabla verificada y lista para usar")
-        except Exception as e:
-            raise Exception(f"No se puede acceder a la tabla después de crearla: {str(e)}")
+        if not output_exists:
+            print(f"Creando tabla '{BQ_OUTPUT_TABLE}'...")
+            from google.cloud import bigquery
+            schema = [
+                bigquery.SchemaField("id_original", "STRING", mode="REQUIRED"),
+                bigquery.SchemaField("titulo", "STRING", mode="REQUIRED"),
+                bigquery.SchemaField("analisis", "STRING", mode="REQUIRED")
+            ]
             
+            table = bigquery.Table(table_id, schema=schema)
+            table = client.create_table(table, exists_ok=True)  # Cambiar a exists_ok=True
+            print(f"✓ Tabla '{BQ_OUTPUT_TABLE}' creada exitosamente")
+            
+            # Esperar a que la tabla esté disponible
+            wait_for_table(table_id)
+            print("✓ Tabla verificada y lista para usar")
+
+        _resources_verified_at = time.monotonic()
         return True
     except Exception as e:
         print(f"Error en la verificación: {str(e)}")
         return False
 
-def insert_with_retry(table_ref, rows_to_insert, max_retries=3):
-    """Función auxiliar para intentar insertar con reintentos"""
-    for attempt in range(max_retries):
+class StageStats:
+    """Métricas de una etapa del pipeline (lectura, generación o escritura).
+
+    Cuenta los elementos procesados, el tiempo que sus hilos pasan trabajando
+    (la ocupación es ese tiempo entre hilos × tiempo transcurrido) y la
+    profundidad de su cola de entrada.
+    """
+
+    def __init__(self, name, workers, queue_capacity=None):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue_capacity = queue_capacity
+        self.started = time.monotonic()
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, items=1):
+        with self._lock:
+            self.busy_seconds += seconds
+            self.items += items
+
+    def set_queue_depth(self, depth):
+        with self._lock:
+            self.queue_depth = depth
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            return {
+                "stage": self.name,
+                "items": self.items,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "queue_capacity": self.queue_capacity,
+                "workers": self.workers,
+                "utilization": min(1.0, self.busy_seconds / (self.workers * elapsed)),
+            }
+
+class PipelineMonitor:
+    """Imprime periódicamente el estado de las etapas hasta que se llama a stop()"""
+
+    def __init__(self, stages, interval=PIPELINE_REPORT_SECONDS):
+        self.stages = stages
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pipeline-monitor", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.report()
+
+    def report(self):
+        parts = []
+        for stage in self.stages:
+            snap = stage.snapshot()
+            capacity = f"/{snap['queue_capacity']}" if snap["queue_capacity"] else ""
+            parts.append(f"{snap['stage']}: {snap['items']} elem., cola {snap['queue_depth']}{capacity} "
+                         f"(máx {snap['max_queue_depth']}), ocupación {snap['utilization']:.0%}")
+        print("Pipeline | " + " | ".join(parts))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+class LatencyHistogram:
+    """Histograma de latencias con buckets fijos (no es seguro entre hilos por sí solo)"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # El último bucket es +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Estimación del cuantil `q` interpolando dentro de su bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative, lower = 0, 0.0
+        for i, n in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            if n and cumulative + n >= rank:
+                return min(lower + (upper - lower) * (rank - cumulative) / n, self.max)
+            cumulative += n
+            lower = upper
+        return self.max
+
+# Etapas con histograma de latencia, contadores e indicadores de la ejecución
+METRIC_STAGES = ("query", "page_fetch", "prompt_build", "generate", "insert", "verify")
+METRIC_COUNTERS = {
+    "rows_read": "Registros leídos de Info",
+    "rows_written": "Filas guardadas en info_detalle",
+    "rows_dead_lettered": "Filas enviadas a filas muertas",
+    "generate_retries": "Reintentos de llamadas al modelo por limitación de cuota",
+    "insert_retries": "Reintentos de insertAll",
+    "cache_hits": "Respuestas servidas desde la caché",
+    "cache_misses": "Consultas a la caché sin respuesta",
+    "input_tokens": "Tokens de entrada (estimados si la respuesta no trae usage_metadata)",
+    "output_tokens": "Tokens de salida (estimados si la respuesta no trae usage_metadata)",
+    "concurrency_adjustments": "Ajustes de la ventana AIMD de llamadas al modelo",
+}
+METRIC_GAUGES = {
+    "concurrency_window": "Ventana AIMD actual de llamadas al modelo en vuelo",
+}
+
+class MetricsRegistry:
+    """Latencias por etapa, contadores e indicadores de una ejecución, seguro entre hilos.
+
+    Se exporta como texto de Prometheus, como archivo OpenMetrics o como
+    resumen JSON de la ejecución (con p50/p95/p99 estimados de los buckets).
+    """
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.utcnow()
+            self.started = time.monotonic()
+            self.histograms = {stage: LatencyHistogram(self.buckets) for stage in METRIC_STAGES}
+            self.counters = dict.fromkeys(METRIC_COUNTERS, 0)
+            self.gauges = dict.fromkeys(METRIC_GAUGES, 0)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.histograms[stage].observe(seconds)
+
+    def inc(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def set(self, gauge, value):
+        with self._lock:
+            self.gauges[gauge] = value
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.monotonic()
         try:
-            errors = bq_client.insert_rows_json(table_ref, rows_to_insert)
-            if not errors:
-                return None
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - started)
+
+    def summary(self):
+        with self._lock:
+            stages = {}
+            for stage, histogram in self.histograms.items():
+                stages[stage] = {
+                    "count": histogram.count,
+                    "sum_seconds": histogram.sum,
+                    "mean_seconds": histogram.sum / histogram.count if histogram.count else None,
+                    "p50_seconds": histogram.quantile(0.5),
+                    "p95_seconds": histogram.quantile(0.95),
+                    "p99_seconds": histogram.quantile(0.99),
+                    "max_seconds": histogram.max if histogram.count else None,
+                }
+            return {
+                "started_at": self.started_at.isoformat() + "Z",
+                "duration_seconds": time.monotonic() - self.started,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "stages": stages,
+            }
+
+    def to_prometheus(self, openmetrics=False):
+        """Texto de exposición de Prometheus, o de OpenMetrics con openmetrics=True"""
+        name = "infoia_stage_duration_seconds"
+        lines = [f"# HELP {name} Latencia de cada etapa del pipeline", f"# TYPE {name} histogram"]
+        if openmetrics:
+            lines.append(f"# UNIT {name} seconds")
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, n in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum!r}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+            for counter, description in METRIC_COUNTERS.items():
+                # En OpenMetrics la familia de un contador se declara sin _total
+                family = f"infoia_{counter}" if openmetrics else f"infoia_{counter}_total"
+                lines.append(f"# HELP {family} {description}")
+                lines.append(f"# TYPE {family} counter")
+                lines.append(f"infoia_{counter}_total {self.counters[counter]}")
+            for gauge, description in METRIC_GAUGES.items():
+                lines.append(f"# HELP infoia_{gauge} {description}")
+                lines.append(f"# TYPE infoia_{gauge} gauge")
+                lines.append(f"infoia_{gauge} {self.gauges[gauge]}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path, fmt=METRICS_FORMAT):
+        """Escribe las métricas en `path` (reemplazando el archivo de forma atómica)"""
+        if fmt == "json":
+            content = json.dumps(self.summary(), indent=2, ensure_ascii=False) + "\n"
+        elif fmt in ("prometheus", "openmetrics"):
+            content = self.to_prometheus(openmetrics=fmt == "openmetrics")
+        else:
+            raise ValueError(f"Formato de métricas desconocido: {fmt}")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        print(f"✓ Métricas ({fmt}) exportadas a {path}")
+
+    def report(self):
+        summary = self.summary()
+        for stage, data in summary["stages"].items():
+            if data["count"]:
+                print(f"Latencia {stage}: {data['count']} llamadas, p50 {data['p50_seconds']:.3f} s, "
+                      f"p95 {data['p95_seconds']:.3f} s, total {data['sum_seconds']:.1f} s")
+        print(f"Contadores: {summary['counters']}")
+        print(f"Indicadores: {summary['gauges']}")
+
+# Métricas compartidas por el proceso; analyze_banana_labels las reinicia en cada ejecución
+metrics = MetricsRegistry()
+
+# Las trazas se configuran al primer uso; sin configurar, trace_span no hace nada
+_tracer = None
+_tracer_provider = None
+_trace_file = None
+_run_trace_context = None
+
+class _NoopSpan:
+    """Span vacío que se usa cuando las trazas están desactivadas"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def error_status_code(error):
+    """Código HTTP de una excepción de las API de Google, o None"""
+    code = getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+class _TraceSpan:
+    """Span de OpenTelemetry como hijo del span actual o, en hilos sin span
+    (generación y escritura), del span raíz de la ejecución. Si termina con
+    una excepción registra además su código HTTP."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        from opentelemetry import trace
+        context = None
+        if not trace.get_current_span().get_span_context().is_valid:
+            context = _run_trace_context
+        self._manager = _tracer.start_as_current_span(self.name, context=context, attributes=self.attributes)
+        self.span = self._manager.__enter__()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and error_status_code(exc) is not None:
+            self.span.set_attribute("http.status_code", error_status_code(exc))
+        return self._manager.__exit__(exc_type, exc, tb)
+
+def trace_span(name, attributes=None):
+    """Span de `name`; con las trazas desactivadas devuelve un span vacío compartido"""
+    if _tracer is None:
+        return _NOOP_SPAN
+    return _TraceSpan(name, attributes)
+
+def configure_tracing(exporter=TRACING_EXPORTER, endpoint=TRACING_OTLP_ENDPOINT, path=TRACING_FILE):
+    """Activa las trazas con el exportador indicado ("otlp" o "file"); None las desactiva"""
+    global _tracer, _tracer_provider, _trace_file
+    if _tracer_provider is not None:
+        _tracer_provider.shutdown()
+    if _trace_file is not None:
+        _trace_file.close()
+    _tracer = _tracer_provider = _trace_file = None
+    if exporter is None:
+        return None
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    if exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        span_exporter = OTLPSpanExporter(endpoint=endpoint, insecure=endpoint.startswith("http://"))
+    elif exporter == "file":
+        _trace_file = open(path, "a", encoding="utf-8")
+        span_exporter = ConsoleSpanExporter(out=_trace_file,
+                                            formatter=lambda span: span.to_json(indent=None) + "\n")
+    else:
+        raise ValueError(f"Exportador de trazas desconocido: {exporter}")
+
+    _tracer_provider = TracerProvider(resource=Resource.create({"service.name": "infoia"}))
+    _tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    _tracer = _tracer_provider.get_tracer("infoia")
+    print(f"✓ Trazas de OpenTelemetry activadas ({exporter}: {endpoint if exporter == 'otlp' else path})")
+    return _tracer
+
+def start_run_trace(attributes):
+    """Abre el span raíz de una ejecución; los spans de otros hilos cuelgan de él"""
+    global _run_trace_context
+    if _tracer is None:
+        return _NOOP_SPAN
+    from opentelemetry import trace
+    span = _tracer.start_span("analyze_banana_labels", attributes=attributes)
+    _run_trace_context = trace.set_span_in_context(span)
+    return span
+
+def end_run_trace(span, error=None):
+    """Cierra el span raíz y envía las trazas pendientes (la instancia puede congelarse después)"""
+    global _run_trace_context
+    if span is _NOOP_SPAN:
+        return
+    if error is not None:
+        from opentelemetry.trace import Status, StatusCode
+        span.record_exception(error)
+        span.set_status(Status(StatusCode.ERROR, str(error)))
+    span.end()
+    _run_trace_context = None
+    _tracer_provider.force_flush()
+
+class DeadLetterSink:
+    """Guarda en un archivo NDJSON las filas que no se pudieron insertar"""
+
+    def __init__(self, path=DEAD_LETTER_FILE):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def write(self, row, errors):
+        record = {
+            "row": row,
+            "errors": errors,
+            "timestamp": datetime.utcnow().isoformat(),
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self.count += 1
+
+dead_letter_sink = DeadLetterSink()
+
+def insert_backoff_delay(attempt):
+    """Espera exponencial con jitter completo para el reintento `attempt`"""
+    cap = min(INSERT_MAX_BACKOFF_SECONDS, INSERT_BASE_BACKOFF_SECONDS * 2 ** attempt)
+    return random.uniform(0, cap)
+
+@lru_cache(maxsize=None)
+def prompt_version():
+    """Huella de la plantilla del prompt; cambia si se modifica el texto.
+
+    La plantilla es fija durante el proceso, así que se calcula una sola vez
+    y no en cada make_insert_id.
+    """
+    template = build_prompt("{titulo}", "{comentario}")
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+def make_insert_id(id_original):
+    """insertId determinista para una fila de info_detalle.
+
+    Depende del Id original, de la versión del prompt y del modelo, así que
+    un reintento de la misma fila lleva el mismo insertId y BigQuery lo
+    deduplica, mientras que un cambio de prompt o de modelo genera filas nuevas.
+    """
+    key = f"{id_original}|{prompt_version()}|{MODEL_NAME}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def insert_with_retry(table_ref, rows_to_insert, max_retries=INSERT_MAX_RETRIES, dead_letter=None,
+                      row_ids=None):
+    """Inserta filas con reintentos, reenviando solo las que fallaron.
+
+    Cada fila lleva un insertId (por defecto `make_insert_id(id_original)`),
+    de modo que reenviar filas que ya se guardaron antes de un timeout no las
+    duplica dentro de la ventana de deduplicación de BigQuery.
+
+    Las filas con errores permanentes, o que siguen fallando tras el último
+    intento, van al sink de filas muertas. Devuelve sus errores (con el índice
+    dentro de `rows_to_insert`) o None si todas se insertaron. Si la llamada
+    lanza una excepción en el último intento, se propaga después de guardar
+    en el sink las filas ya rechazadas de forma permanente.
+    """
+    dead_letter = dead_letter or dead_letter_sink
+    if row_ids is None:
+        row_ids = [make_insert_id(row["id_original"]) for row in rows_to_insert]
+    pending = list(range(len(rows_to_insert)))
+    rejected = []
+    retry = []
+    for attempt in range(max(1, max_retries)):
+        if attempt:
+            metrics.inc("insert_retries")
+            time.sleep(insert_backoff_delay(attempt - 1))
+        try:
+            with trace_span("insert_rows_json", {"infoia.rows": len(pending), "infoia.attempt": attempt}) as span:
+                with metrics.timer("insert"):
+                    errors = get_bq_client().insert_rows_json(
+                        table_ref,
+                        [rows_to_insert[i] for i in pending],
+                        row_ids=[row_ids[i] for i in pending],
+                    )
+                span.set_attribute("infoia.row_errors", len(errors or []))
         except Exception as e:
-            if attempt == max_retries - 1:
+            if attempt >= max_retries - 1:
+                for entry in rejected:
+                    dead_letter.write(rows_to_insert[entry["index"]], entry["errors"])
                 raise e
-            time.sleep(2 ** attempt)  # Espera exponencial
-    return errors
+            continue
+
+        retry = []
+        for error in errors or []:
+            row_errors = list(error.get("errors", []))
+            entry = {"index": pending[error["index"]], "errors": row_errors}
+            reasons = {row_error.get("reason") for row_error in row_errors}
+            if reasons & PERMANENT_INSERT_ERROR_REASONS:
+                rejected.append(entry)
+            else:
+                retry.append(entry)
+        pending = [entry["index"] for entry in retry]
+        if not pending:
+            break
+    rejected.extend(retry)
+
+    for entry in rejected:
+        dead_letter.write(rows_to_insert[entry["index"]], entry["errors"])
+    return rejected or None
+
+class SystemClock:
+    """Reloj real basado en time.monotonic"""
+
+    def now(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    async def sleep_async(self, seconds):
+        if seconds > 0:
+            import asyncio
+            await asyncio.sleep(seconds)
+
+class FakeClock:
+    """Reloj determinista para pruebas: dormir solo avanza el tiempo"""
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def now(self):
+        with self._lock:
+            return self._now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self._now += max(0.0, seconds)
+
+    advance = sleep
+
+    async def sleep_async(self, seconds):
+        self.sleep(seconds)
+
+class TokenBucket:
+    """Cubeta de tokens con recarga continua (no es segura entre hilos por sí sola)"""
+
+    def __init__(self, capacity, refill_per_second, clock):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated_at = clock.now()
+
+    def _refill(self):
+        now = self.clock.now()
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+        self.updated_at = now
+
+    def time_until(self, amount):
+        """Segundos que faltan para disponer de `amount` tokens"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount):
+        # Puede quedar en negativo al conciliar el consumo real: es una deuda
+        # que se paga con la recarga antes de admitir nuevas solicitudes
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+class RateLimiter:
+    """Limitador compartido con presupuesto de solicitudes y de tokens por minuto.
+
+    Es seguro entre hilos (acquire) y entre tareas asyncio (acquire_async).
+    Cada llamada reserva una solicitud y una estimación de tokens; cuando se
+    conoce el consumo real se concilia con `record_usage`.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, clock=None):
+        self.clock = clock or SystemClock()
+        self._lock = threading.Lock()
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60.0, self.clock)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0, self.clock)
+
+    def _try_reserve(self, tokens):
+        """Reserva si hay presupuesto; si no, devuelve los segundos a esperar"""
+        with self._lock:
+            delay = max(self.requests.time_until(1), self.tokens.time_until(tokens))
+            if delay <= 0:
+                self.requests.consume(1)
+                self.tokens.consume(tokens)
+            return delay
+
+    def acquire(self, tokens=0):
+        while True:
+            delay = self._try_reserve(tokens)
+            if delay <= 0:
+                return
+            self.clock.sleep(delay)
+
+    async def acquire_async(self, tokens=0):
+        while True:
+            delay = self._try_reserve(tokens)
+            if delay <= 0:
+                return
+            await self.clock.sleep_async(delay)
+
+    def record_usage(self, reserved_tokens, actual_tokens):
+        """Ajusta el presupuesto de tokens con el consumo real de la llamada"""
+        with self._lock:
+            self.tokens.consume(actual_tokens - reserved_tokens)
+
+def estimate_tokens(text):
+    """Estimación rápida de tokens (aprox. 4 caracteres por token)"""
+    return len(text) // 4 + 1
+
+def response_token_count(response):
+    """Tokens reales consumidos según usage_metadata, o None si no vienen"""
+    usage = getattr(response, "usage_metadata", None)
+    total = getattr(usage, "total_token_count", None)
+    return total if isinstance(total, int) else None
+
+def response_token_usage(response, prompt, text):
+    """Tokens de entrada y salida según usage_metadata, o estimados si no vienen"""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    output_tokens = getattr(usage, "candidates_token_count", None)
+    if not isinstance(prompt_tokens, int):
+        prompt_tokens = estimate_tokens(prompt)
+    if not isinstance(output_tokens, int):
+        output_tokens = estimate_tokens(text or "")
+    return prompt_tokens, output_tokens
+
+# Limitador compartido por todas las llamadas al modelo del proceso
+rate_limiter = RateLimiter(
+    VERTEX_REQUESTS_PER_MINUTE * QUOTA_SAFETY_FACTOR,
+    VERTEX_TOKENS_PER_MINUTE * QUOTA_SAFETY_FACTOR,
+)
+
+# Entre cuántos procesos se reparte la cuota que usa rate_limiter
+_rate_limiter_share = 1
+
+def share_quota(process_count):
+    """Deja a rate_limiter con 1/`process_count` de la cuota de Vertex AI del proyecto.
+
+    Se llama en cada ejecución y solo reemplaza el limitador si cambia el
+    reparto: una invocación en caliente sin fragmentos recupera la cuota entera.
+    """
+    global rate_limiter, _rate_limiter_share
+    process_count = max(1, int(process_count))
+    if process_count == _rate_limiter_share:
+        return
+    rate_limiter = RateLimiter(
+        VERTEX_REQUESTS_PER_MINUTE * QUOTA_SAFETY_FACTOR / process_count,
+        VERTEX_TOKENS_PER_MINUTE * QUOTA_SAFETY_FACTOR / process_count,
+    )
+    _rate_limiter_share = process_count
+
+class AdaptiveConcurrencyController:
+    """Ventana de solicitudes en vuelo ajustada con AIMD.
+
+    Crece de forma aditiva (+AIMD_INCREASE por ventana completa de llamadas
+    sanas) y se reduce de forma multiplicativa ante 429/503. Las reducciones
+    se aplican como mucho una vez por latencia observada, para que una ráfaga
+    de rechazos simultáneos no colapse la ventana al mínimo. La ventana actual,
+    los contadores y cada ajuste quedan disponibles en `metrics()`; la ventana
+    y el número de ajustes se exportan además en el registro `metrics`.
+    """
+
+    def __init__(self, initial=INITIAL_CONCURRENT_REQUESTS, min_limit=MIN_CONCURRENT_REQUESTS,
+                 max_limit=MAX_CONCURRENT_REQUESTS, target_latency=TARGET_MODEL_LATENCY_SECONDS,
+                 increase=AIMD_INCREASE, decrease_factor=AIMD_DECREASE_FACTOR, clock=None):
+        self.clock = clock or SystemClock()
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.adjustments = []
+        self.counters = {"ok": 0, "slow": 0, "throttled": 0, "error": 0}
+        self._last_decrease_at = None
+        self._cond = threading.Condition()
+        metrics.set("concurrency_window", self.window)
+
+    @property
+    def window(self):
+        return int(self.limit)
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.window:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, outcome):
+        """Libera un hueco y ajusta la ventana según el resultado de la llamada.
+
+        `outcome` es "ok", "throttled" o "error".
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == "ok" and latency > self.target_latency:
+                outcome = "slow"
+            self.counters[outcome] += 1
+
+            previous = self.window
+            now = self.clock.now()
+            if outcome == "ok":
+                self.limit = min(self.max_limit, self.limit + self.increase / self.window)
+            elif outcome == "throttled":
+                recent = (self._last_decrease_at is not None
+                          and now - self._last_decrease_at < latency)
+                if not recent:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease_at = now
+
+            if self.window != previous:
+                adjustment = {"time": now, "from": previous, "to": self.window,
+                              "reason": outcome, "latency": latency}
+                self.adjustments.append(adjustment)
+                metrics.inc("concurrency_adjustments")
+                metrics.set("concurrency_window", self.window)
+                print(f"Concurrencia ajustada {previous} -> {self.window} ({outcome}, {latency:.2f}s)")
+            self._cond.notify_all()
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "window": self.window,
+                "in_flight": self.in_flight,
+                "adjustments": len(self.adjustments),
+                **self.counters,
+            }
 
-def analyze_banana_labels(event=None, context=None):
+def is_throttling_error(error):
+    """Indica si la excepción corresponde a un 429 o 503 de Vertex AI"""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable"):
+        return True
+    code = getattr(error, "code", None)
     try:
-        if not verify_bigquery_resources():
-            raise Exception("Falló la verificación de recursos de BigQuery")
+        return int(code) in (429, 503)
+    except (TypeError, ValueError):
+        return False
+
+class BufferedWriter:
+    """Acumula filas de info_detalle y las inserta por lotes en un hilo de fondo.
+
+    Un lote se envía al alcanzar `max_rows` filas, al superar `max_bytes` o
+    cuando la fila más antigua lleva `max_seconds` esperando; `workers` hilos
+    envían los lotes en paralelo desde una cola acotada, que frena a quien
+    escribe si BigQuery va más lento. `close()` (o salir del bloque `with`)
+    envía lo pendiente y espera a los hilos. Las filas rechazadas van a filas
+    muertas sin detener la ejecución; una excepción de inserción se vuelve a
+    lanzar en el siguiente `write()` o en `close()`. `on_commit` recibe los
+    id_original de cada lote una vez guardados.
+    """
+
+    _STOP = object()
+
+    def __init__(self, table_ref, max_rows=WRITE_BATCH_MAX_ROWS, max_bytes=WRITE_BATCH_MAX_BYTES,
+                 max_seconds=WRITE_BATCH_MAX_SECONDS, insert=None, workers=WRITE_WORKERS, stage=None,
+                 on_commit=None):
+        self.table_ref = table_ref
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self._insert = insert or insert_with_retry
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffer_started = None
+        self._batches = queue.Queue(maxsize=WRITE_QUEUE_MAX_BATCHES)
+        self._error = None
+        self._closed = False
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.batches_written = 0
+        self.stage = stage
+        self.on_commit = on_commit
+        self._threads = [threading.Thread(target=self._run, name=f"info-detalle-writer-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            try:
+                self.close()
+            except Exception as e:
+                print(f"Error al vaciar el búfer de escritura: {str(e)}")
+        return False
+
+    def write(self, row):
+        self._raise_if_failed()
+        size = len(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+        # Los lotes se encolan fuera del candado: con la cola llena put() espera
+        # a los hilos escritores, que necesitan el candado para terminar un lote
+        ready = []
+        with self._lock:
+            if self._closed:
+                raise Exception("El escritor de info_detalle ya está cerrado")
+            if self._buffer and self._buffer_bytes + size > self.max_bytes:
+                ready.append(self._take_buffer())
+            if not self._buffer:
+                self._buffer_started = time.monotonic()
+            self._buffer.append(row)
+            self._buffer_bytes += size
+            if len(self._buffer) >= self.max_rows:
+                ready.append(self._take_buffer())
+        for batch in ready:
+            self._enqueue(batch)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            batch = self._take_buffer() if self._buffer else None
+        if batch:
+            self._enqueue(batch)
+        for thread in self._threads:
+            self._batches.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
+        self._raise_if_failed()
+
+    def _enqueue(self, batch):
+        self._batches.put(batch)
+        if self.stage:
+            self.stage.set_queue_depth(self._batches.qsize())
+
+    def _take_buffer(self):
+        batch = self._buffer
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffer_started = None
+        return batch
+
+    def _take_stale_buffer(self):
+        with self._lock:
+            if self._buffer and time.monotonic() - self._buffer_started >= self.max_seconds:
+                return self._take_buffer()
+        return None
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._batches.get(timeout=self.max_seconds)
+            except queue.Empty:
+                batch = self._take_stale_buffer()
+                if batch is None:
+                    continue
+            if self.stage:
+                self.stage.set_queue_depth(self._batches.qsize())
+            if batch is self._STOP:
+                return
+            self._write_batch(batch)
+            stale = self._take_stale_buffer()
+            if stale:
+                self._write_batch(stale)
+
+    def _write_batch(self, batch):
+        if self._error is not None:
+            return  # Tras un fallo solo se drena la cola para no bloquear a los productores
+        started = time.monotonic()
+        try:
+            errors = self._insert(self.table_ref, batch) or []
+            if self.on_commit:
+                rejected = {error["index"] for error in errors}
+                self.on_commit([row["id_original"] for i, row in enumerate(batch) if i not in rejected])
+            with self._lock:
+                self.rows_written += len(batch) - len(errors)
+                self.rows_failed += len(errors)
+                self.batches_written += 1
+                total = self.rows_written
+            if errors:
+                print(f"Error al guardar análisis ({len(errors)} filas enviadas a filas muertas): {errors}")
+            print(f"✓ {len(batch) - len(errors)} análisis guardados (total: {total})")
+        except Exception as e:
+            print(f"Error al intentar guardar el análisis: {str(e)}")
+            self._error = e
+        finally:
+            if self.stage:
+                self.stage.record(time.monotonic() - started, len(batch))
+
+class LoadJobWriter:
+    """Escribe info_detalle preparando NDJSON y cargándolo con load jobs.
+
+    Misma interfaz que BufferedWriter, pensada para backfills grandes: las
+    filas se escriben en un archivo temporal y, al llegar a `max_bytes`, el
+    archivo se carga con WRITE_APPEND en un hilo de fondo. Cada load job es
+    atómico, así que un archivo se guarda completo o no se guarda. `close()`
+    carga el último archivo y espera a todos los trabajos. Con `schema` la
+    tabla se crea si no existe (se usa para las tablas de staging).
+    `on_commit` recibe los id_original de cada archivo una vez cargado.
+    """
+
+    def __init__(self, table_ref, max_bytes=LOAD_JOB_MAX_BYTES, schema=None, stage=None, on_commit=None):
+        self.table_ref = table_ref
+        self.max_bytes = max_bytes
+        self.schema = schema
+        self.stage = stage
+        self.on_commit = on_commit
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="info-detalle-load")
+        self._futures = []
+        self._file = None
+        self._file_ids = []
+        self._file_bytes = 0
+        self._closed = False
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.batches_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            try:
+                self.close()
+            except Exception as e:
+                print(f"Error al cargar los archivos pendientes: {str(e)}")
+        return False
+
+    def write(self, row):
+        self._raise_if_failed()
+        line = (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if self._closed:
+                raise Exception("El escritor de info_detalle ya está cerrado")
+            if self._file is None:
+                self._file = tempfile.NamedTemporaryFile(prefix="info_detalle_", suffix=".ndjson", delete=False)
+            self._file.write(line)
+            self._file_ids.append(row.get("id_original"))
+            self._file_bytes += len(line)
+            if self._file_bytes >= self.max_bytes:
+                self._submit_file()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._file is not None:
+                self._submit_file()
+        self._executor.shutdown(wait=True)
+        for future in self._futures:
+            future.result()
+
+    def _submit_file(self):
+        self._file.close()
+        future = self._executor.submit(self._load_file, self._file.name, self._file_ids)
+        self._futures.append(future)
+        self._file = None
+        self._file_ids = []
+        self._file_bytes = 0
+
+        # Si BigQuery va más lento que la generación, esperar al archivo más antiguo
+        pending = [f for f in self._futures if not f.done()]
+        if self.stage:
+            self.stage.set_queue_depth(len(pending))
+        if len(pending) > LOAD_JOB_MAX_PENDING_FILES:
+            wait(pending[:len(pending) - LOAD_JOB_MAX_PENDING_FILES])
+
+    def _load_file(self, path, ids):
+        started = time.monotonic()
+        try:
+            from google.cloud import bigquery
+            job_config = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            )
+            if self.schema:
+                job_config.schema = self.schema
+            with trace_span("load_table_from_file", {"infoia.rows": len(ids)}), metrics.timer("insert"), \
+                    open(path, "rb") as f:
+                job = get_bq_client().load_table_from_file(f, self.table_ref, job_config=job_config)
+                job.result()
+            if self.on_commit:
+                self.on_commit(ids)
+            self.rows_written += len(ids)
+            self.batches_written += 1
+            print(f"✓ {len(ids)} análisis cargados con el job {job.job_id} (total: {self.rows_written})")
+        except Exception as e:
+            print(f"Error al cargar el archivo {path}: {str(e)}")
+            raise e
+        finally:
+            os.remove(path)
+            if self.stage:
+                self.stage.record(time.monotonic() - started, len(ids))
+
+    def _raise_if_failed(self):
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+class CheckpointJournal:
+    """Diario local de solo anexado con los Id ya guardados en info_detalle.
+
+    La primera línea identifica la ejecución; cada lote confirmado por el
+    escritor añade una línea con sus Id (con fsync) y una ejecución completa
+    termina con una marca de fin. Si al arrancar el diario no tiene esa marca
+    pero sí Id confirmados, la ejecución anterior se interrumpió y se reanuda:
+    sus Id se omiten. Un diario sin Id confirmados no se reanuda (la ejecución
+    anterior no llegó a escribir nada) y se reemplaza por uno nuevo. Tampoco
+    se reanuda el de una ejecución en otro modo (ver discard()).
+    """
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = path
+        self.run_id = None
+        self.full_rebuild = False
+        self.resumed = False
+        self.completed = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        header, finished, completed = None, False, set()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Línea a medio escribir por una caída
+                if header is None and "run_id" in record:
+                    header = record
+                elif "ids" in record:
+                    completed.update(record["ids"])
+                elif record.get("finished"):
+                    finished = True
+        if header is not None and not finished and completed:
+            self.resumed = True
+            self.run_id = header["run_id"]
+            self.full_rebuild = header.get("full_rebuild", False)
+            self.completed = completed
+
+    def _append(self, record, mode="a"):
+        with open(self.path, mode, encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, full_rebuild):
+        """Empieza una ejecución nueva o continúa la interrumpida"""
+        if self.resumed:
+            # Cerrar una posible última línea incompleta antes de seguir anexando
+            with open(self.path, "rb+") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+            print(f"Reanudando la ejecución {self.run_id}: {len(self.completed)} registros ya guardados")
+            return
+        self.run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        self.full_rebuild = full_rebuild
+        self.completed = set()
+        self._append({"run_id": self.run_id, "full_rebuild": full_rebuild}, mode="w")
+
+    def discard(self):
+        """Olvida la ejecución interrumpida; start() empezará un diario nuevo"""
+        self.resumed = False
+        self.run_id = None
+        self.full_rebuild = False
+        self.completed = set()
+
+    def is_completed(self, id_original):
+        return id_original in self.completed
+
+    def mark_committed(self, ids):
+        if not ids:
+            return
+        with self._lock:
+            self._append({"ids": list(ids)})
+            self.completed.update(ids)
+
+    def finish(self):
+        with self._lock:
+            self._append({"finished": True})
+
+def checkpoint_path(shard_index=0, shard_count=1):
+    """Diario propio de cada fragmento, para que las tareas no lo compartan"""
+    if shard_count <= 1:
+        return CHECKPOINT_FILE
+    base, ext = os.path.splitext(CHECKPOINT_FILE)
+    return f"{base}.shard{shard_index}of{shard_count}{ext}"
+
+class WorkQueue:
+    """Cola de trabajo en SQLite con arrendamientos por Id de Info.
+
+    Cada Id tiene estado (pending, leased, done o failed), dueño y
+    vencimiento del arrendamiento. Los trabajadores reclaman lotes de forma
+    atómica, un hilo renueva sus arrendamientos entre start() y stop(), y el
+    escritor marca los Id como hechos al confirmarlos (complete). Los
+    arrendamientos vencidos de un trabajador caído pasan a otro; tras
+    `max_attempts` reclamos un Id queda como fallido. Como ResponseCache, usa
+    WAL con una conexión por hilo y admite varios procesos. `workers` es el
+    número de trabajadores que comparten la cuota del proyecto.
+    """
 
-        # Consulta simple para obtener todos los registros
-        query = """
-            SELECT Id, Titulo, Comentario
-            FROM `website-401719.db_informacion.Info`
+    def __init__(self, path=WORK_QUEUE_FILE, owner=None, lease_seconds=WORK_QUEUE_LEASE_SECONDS,
+                 claim_size=WORK_QUEUE_CLAIM_SIZE, max_attempts=WORK_QUEUE_MAX_ATTEMPTS,
+                 poll_seconds=WORK_QUEUE_POLL_SECONDS, workers=WORK_QUEUE_WORKERS, now=time.time):
+        self.path = path
+        self.owner = owner or f"worker-{os.getpid()}-{random.getrandbits(24):06x}"
+        self.workers = max(1, int(workers))
+        self.lease_seconds = lease_seconds
+        self.claim_size = claim_size
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.now = now
+        self.claimed = 0
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._thread = None
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS work_items (
+                    id TEXT PRIMARY KEY,
+                    titulo TEXT,
+                    comentario TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    lease_owner TEXT,
+                    lease_expiry REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claim TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS work_items_status ON work_items (status, lease_expiry)")
+            conn.execute("CREATE INDEX IF NOT EXISTS work_items_claim ON work_items (claim)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def seed(self, rows):
+        """Agrega los registros a la cola; los Id que ya estaban no cambian"""
+        before = self.counts()
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO work_items (id, titulo, comentario) VALUES (?, ?, ?)",
+                ((str(row["Id"]), row["Titulo"], row["Comentario"]) for row in rows),
+            )
+        return sum(self.counts().values()) - sum(before.values())
+
+    def claim(self, limit=None):
+        """Arrienda hasta `limit` Id pendientes o con arrendamiento vencido"""
+        now = self.now()
+        claim_id = f"{self.owner}:{random.getrandbits(32):08x}"
+        with self._connection() as conn:
+            conn.execute("""
+                UPDATE work_items SET status = 'failed', lease_owner = NULL, lease_expiry = NULL
+                WHERE attempts >= ? AND (status = 'pending' OR (status = 'leased' AND lease_expiry < ?))
+            """, (self.max_attempts, now))
+            conn.execute("""
+                UPDATE work_items
+                SET status = 'leased', lease_owner = ?, lease_expiry = ?, attempts = attempts + 1, claim = ?
+                WHERE id IN (
+                    SELECT id FROM work_items
+                    WHERE status = 'pending' OR (status = 'leased' AND lease_expiry < ?)
+                    LIMIT ?
+                )
+            """, (self.owner, now + self.lease_seconds, claim_id, now, limit or self.claim_size))
+            rows = conn.execute("SELECT id, titulo, comentario FROM work_items WHERE claim = ?",
+                                (claim_id,)).fetchall()
+        self.claimed += len(rows)
+        return [{"Id": id_original, "Titulo": titulo, "Comentario": comentario}
+                for id_original, titulo, comentario in rows]
+
+    def renew(self):
+        with self._connection() as conn:
+            conn.execute("UPDATE work_items SET lease_expiry = ? WHERE lease_owner = ? AND status = 'leased'",
+                         (self.now() + self.lease_seconds, self.owner))
+
+    def complete(self, ids):
+        with self._connection() as conn:
+            conn.executemany(
+                "UPDATE work_items SET status = 'done', lease_owner = NULL, lease_expiry = NULL WHERE id = ?",
+                ((id_original,) for id_original in ids),
+            )
+
+    def release(self, ids=None, started=True):
+        """Devuelve a pending los Id propios (todos si `ids` es None).
+
+        Con started=False no cuentan como intento (nunca se llegaron a procesar).
         """
-        
-        print("Consultando registros de la tabla Info...")
-        query_job = bq_client.query(query)
-        rows = list(query_job.result())
-        
-        print(f"Se encontraron {len(rows)} registros para analizar")
+        query = ("UPDATE work_items SET status = 'pending', lease_owner = NULL, lease_expiry = NULL, "
+                 f"attempts = attempts - {0 if started else 1} "
+                 "WHERE lease_owner = ? AND status = 'leased'")
+        with self._connection() as conn:
+            if ids is None:
+                conn.execute(query, (self.owner,))
+            else:
+                conn.executemany(query + " AND id = ?", ((self.owner, id_original) for id_original in ids))
 
-        # Inicializar el modelo Gemini correctamente
-        model = GenerativeModel("gemini-pro")
+    def owns_leases(self):
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM work_items WHERE status = 'leased' AND lease_owner = ?", (self.owner,),
+        ).fetchone()
+        return row[0] > 0
 
-        for row in rows:
-            titulo = row['Titulo']
-            comentario = row['Comentario']
-            print(f"\nAnalizando registro con título: {titulo}")
+    def others_active(self):
+        """Si otros trabajadores tienen arrendamientos vigentes"""
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM work_items WHERE status = 'leased' AND lease_owner != ? AND lease_expiry >= ?",
+            (self.owner, self.now()),
+        ).fetchone()
+        return row[0] > 0
+
+    def counts(self):
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM work_items GROUP BY status").fetchall()
+        return dict(rows)
+
+    def iter_rows(self):
+        """Produce los registros reclamados lote a lote hasta vaciar la cola.
+
+        Si solo quedan Id arrendados por otros trabajadores y este no tiene
+        nada propio sin confirmar, espera por si alguno cae y sus
+        arrendamientos vencen; con Id propios en vuelo termina, porque esperar
+        frenaría su propio pipeline y dos trabajadores se esperarían entre sí.
+        Si el consumidor deja de iterar, los Id del lote que no llegó a tomar
+        se liberan.
+        """
+        while True:
+            batch = self.claim()
+            if not batch:
+                if self.owns_leases() or not self.others_active():
+                    return
+                time.sleep(self.poll_seconds)
+                continue
+            taken = 0
+            try:
+                for row in batch:
+                    taken += 1
+                    yield row
+            finally:
+                if taken < len(batch):
+                    self.release([str(row["Id"]) for row in batch[taken:]], started=False)
+
+    def start(self):
+        """Renueva en segundo plano los arrendamientos propios hasta stop()"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._heartbeat, name="work-queue-lease", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Detiene la renovación y libera lo que quedó sin confirmar (p. ej. filas muertas)"""
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        self.release()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.renew()
+            except sqlite3.Error as e:
+                print(f"Error renovando arrendamientos: {str(e)}")
+
+def create_output_writer(table_ref, expected_rows, backend=OUTPUT_BACKEND, stage=None, on_commit=None):
+    """Elige el escritor de info_detalle según el backend y el volumen esperado"""
+    if backend == "auto":
+        backend = "load_job" if expected_rows >= LOAD_JOB_ROW_THRESHOLD else "streaming"
+    print(f"Backend de salida: {backend} ({expected_rows} filas esperadas)")
+    if backend == "load_job":
+        return LoadJobWriter(table_ref, stage=stage, on_commit=on_commit)
+    if backend == "streaming":
+        return BufferedWriter(table_ref, stage=stage, on_commit=on_commit)
+    raise ValueError(f"Backend de salida desconocido: {backend}")
+
+def iter_pages_from_readers(readers, max_pages, stage=None):
+    """Ejecuta cada lector en un hilo y produce las filas de sus páginas.
+
+    Cada lector recibe `put(page)` y debe dejar de leer si devuelve False
+    (el consumidor dejó de iterar). La cola admite `max_pages` páginas, lo que
+    acota la memoria y frena a los lectores cuando la generación va más lenta.
+    Con `stage` se registran las filas leídas, el tiempo de lectura (sin contar
+    la espera por cola llena) y la profundidad de la cola.
+    """
+    pages = queue.Queue(maxsize=max_pages)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                if stage:
+                    stage.set_queue_depth(pages.qsize())
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(read):
+        last = [time.monotonic()]
+
+        def timed_put(page):
+            elapsed = time.monotonic() - last[0]
+            metrics.observe("page_fetch", elapsed)
+            metrics.inc("rows_read", len(page))
+            if stage:
+                stage.record(elapsed, len(page))
+            accepted = put(page)
+            last[0] = time.monotonic()
+            return accepted
+
+        try:
+            read(timed_put)
+        except Exception as e:
+            put(e)
+        finally:
+            put(end)
+
+    for i, read in enumerate(readers):
+        threading.Thread(target=run, args=(read,), name=f"info-reader-{i}", daemon=True).start()
+    try:
+        finished = 0
+        while finished < len(readers):
+            page = pages.get()
+            if stage:
+                stage.set_queue_depth(pages.qsize())
+            if page is end:
+                finished += 1
+                continue
+            if isinstance(page, Exception):
+                raise page
+            yield from page
+    finally:
+        stop.set()
+
+class QueryRowStream:
+    """Itera los resultados de una consulta página a página.
+
+    Un hilo de fondo descarga las páginas de `query_job.result(page_size=...)`
+    y las deja en una cola acotada, así la generación empieza con la primera
+    página y la memoria no depende del tamaño de la tabla: como mucho hay
+    `max_pages` páginas en cola más la que se está procesando.
+    """
+
+    def __init__(self, query_job, page_size=INPUT_PAGE_SIZE, max_pages=INPUT_QUEUE_MAX_PAGES, stage=None):
+        self._result = query_job.result(page_size=page_size)
+        self.total_rows = self._result.total_rows
+        self.max_pages = max_pages
+        self.stage = stage
+
+    def __iter__(self):
+        def read(put):
+            for page in self._result.pages:
+                if not put(list(page)):
+                    return
+
+        return iter_pages_from_readers([read], self.max_pages, self.stage)
+
+class StorageReadRowStream:
+    """Lee el resultado de una consulta con la BigQuery Storage Read API.
+
+    Abre una sesión de lectura en formato Arrow sobre la tabla de destino de
+    la consulta, proyectando solo INPUT_COLUMNS, y lee sus streams en paralelo
+    hacia una cola acotada (misma garantía de memoria que QueryRowStream).
+    `read_client` permite inyectar un cliente, p. ej. el falso de infoia_local.
+    """
+
+    def __init__(self, query_job, max_streams=STORAGE_READ_MAX_STREAMS, max_pages=INPUT_QUEUE_MAX_PAGES,
+                 read_client=None, stage=None):
+        result = query_job.result()
+        self.total_rows = result.total_rows
+        destination = query_job.destination
+        self.table_path = (f"projects/{destination.project}/datasets/{destination.dataset_id}"
+                           f"/tables/{destination.table_id}")
+        self.max_streams = max_streams
+        self.max_pages = max_pages
+        self.stage = stage
+        if read_client is None:
+            from google.cloud import bigquery_storage
+            read_client = bigquery_storage.BigQueryReadClient()
+        self.read_client = read_client
+
+    def __iter__(self):
+        session = self.read_client.create_read_session(
+            parent=f"projects/{PROJECT_ID}",
+            read_session={
+                "table": self.table_path,
+                "data_format": "ARROW",
+                "read_options": {"selected_fields": INPUT_COLUMNS},
+            },
+            max_stream_count=self.max_streams,
+        )
+
+        def stream_reader(stream_name):
+            def read(put):
+                reader = self.read_client.read_rows(stream_name)
+                for page in reader.rows(session).pages:
+                    if not put(page.to_arrow().to_pylist()):
+                        return
+            return read
+
+        readers = [stream_reader(stream.name) for stream in session.streams]
+        if self.stage:
+            self.stage.workers = max(1, len(readers))
+        return iter_pages_from_readers(readers, self.max_pages, self.stage)
+
+def open_input_stream(query_job, reader=INPUT_READER, stage=None):
+    """Devuelve el iterador de filas de entrada según el lector configurado"""
+    if reader == "storage_api":
+        return StorageReadRowStream(query_job, stage=stage)
+    if reader == "rest":
+        return QueryRowStream(query_job, stage=stage)
+    raise ValueError(f"Lector de entrada desconocido: {reader}")
+
+class ResponseCache:
+    """Caché en disco de respuestas del modelo, direccionada por contenido.
+
+    La clave es un hash del prompt renderizado, el modelo y la configuración
+    de generación. Usa SQLite en modo WAL con una conexión por hilo, así que
+    varios hilos o procesos pueden compartir el mismo archivo. Las entradas
+    caducan a los `ttl_seconds` y, si el total supera `max_bytes`, se expulsan
+    las usadas hace más tiempo (LRU).
+    """
+
+    EVICT_EVERY_PUTS = 100
+
+    def __init__(self, path=RESPONSE_CACHE_FILE, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, now=time.time):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.now = now
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    @staticmethod
+    def make_key(prompt, model_name=MODEL_NAME, generation_config=GENERATION_CONFIG):
+        payload = json.dumps(
+            {"model": model_name, "config": generation_config or {}, "prompt": prompt},
+            sort_keys=True, ensure_ascii=False, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
 
-            # Construir el prompt
-            prompt = f"""
+    def get(self, key):
+        now = self.now()
+        with self._connection() as conn:
+            row = conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    def put(self, key, value):
+        now = self.now()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % self.EVICT_EVERY_PUTS == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Elimina las entradas caducadas y las menos usadas por encima del tope"""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (self.now() - self.ttl_seconds,))
+            conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC, key) AS kept
+                        FROM responses
+                    ) WHERE kept > ?
+                )
+            """, (self.max_bytes,))
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+_response_cache = None
+
+def get_response_cache():
+    """Caché de respuestas compartida por el proceso (se abre al primer uso)"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
+
+def normalize_text(text):
+    """Normaliza texto para comparar: minúsculas, sin acentos ni puntuación y espacios simples"""
+    text = unicodedata.normalize("NFKD", str(text or "")).lower()
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+class MinHashLSH:
+    """Índice MinHash/LSH para encontrar textos casi duplicados en tiempo casi lineal.
+
+    Cada texto se resume en el conjunto de hashes de sus shingles de
+    caracteres y en una firma de `num_perm` mínimos de hash; la firma se parte
+    en bandas y dos textos son candidatos si coinciden en alguna banda. Los
+    candidatos se confirman con la similitud de Jaccard exacta de sus shingles:
+    la estimada por la firma (±0.05 con 64 permutaciones) deja los pares
+    cercanos al umbral a la suerte.
+    """
+
+    PRIME = 4294967311  # primo mayor que 2**32
+
+    def __init__(self, threshold, num_perm=MINHASH_NUM_PERM, shingle_size=MINHASH_SHINGLE_SIZE, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows_per_band = self._choose_bands(threshold, num_perm)
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, self.PRIME), rng.randrange(0, self.PRIME)) for _ in range(num_perm)]
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = {}
+        self._shingles = {}
+
+    @staticmethod
+    def _choose_bands(threshold, num_perm, min_recall=0.99):
+        """Bandas b y filas r (b*r = num_perm) para el umbral pedido.
+
+        Se elige la opción con más filas por banda (menos candidatos) que aún
+        detecta un par con similitud `threshold` con probabilidad >= min_recall.
+        """
+        options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+        for b, r in options:
+            if 1 - (1 - threshold ** r) ** b >= min_recall:
+                return b, r
+        return options[-1]
+
+    def shingles(self, text):
+        text = normalize_text(text)
+        if len(text) <= self.shingle_size:
+            return {text}
+        return {text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1)}
+
+    def sketch(self, text):
+        """(hashes de los shingles, firma MinHash) de un texto"""
+        hashes = frozenset(zlib.crc32(shingle.encode("utf-8")) for shingle in self.shingles(text))
+        return hashes, tuple(min((a * h + b) % self.PRIME for h in hashes) for a, b in self._perms)
+
+    def _band_keys(self, signature):
+        r = self.rows_per_band
+        return [hash(signature[i * r:(i + 1) * r]) for i in range(self.bands)]
+
+    def insert(self, key, sketch):
+        if key in self._signatures:
+            self.remove(key)
+        hashes, signature = sketch
+        self._signatures[key] = signature
+        self._shingles[key] = hashes
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(band_key, []).append(key)
+
+    def remove(self, key):
+        """Quita una clave del índice (sus bandas salen de la firma guardada)"""
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        del self._shingles[key]
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            keys = bucket.get(band_key)
+            if keys is not None:
+                keys.remove(key)
+                if not keys:
+                    del bucket[band_key]
+
+    def matches(self, sketch):
+        """Claves indexadas con similitud >= umbral, como lista de (clave, similitud)"""
+        hashes, signature = sketch
+        found, seen = [], set()
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            for candidate in bucket.get(band_key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                similarity = self.similarity(hashes, self._shingles[candidate])
+                if similarity >= self.threshold:
+                    found.append((candidate, similarity))
+        return found
+
+    def query(self, sketch):
+        """Clave más parecida por encima del umbral, o None"""
+        return max(self.matches(sketch), key=lambda match: match[1], default=(None, 0.0))[0]
+
+    @staticmethod
+    def similarity(shingles_a, shingles_b):
+        """Jaccard exacto entre dos conjuntos de shingles"""
+        union = len(shingles_a | shingles_b)
+        return len(shingles_a & shingles_b) / union if union else 1.0
+
+def evaluate_lsh_recall(texts, threshold, num_perm=MINHASH_NUM_PERM):
+    """Compara el índice LSH con la comparación exacta por pares (benchmark).
+
+    Calcula los pares con Jaccard exacto >= threshold (O(n²), usar con una
+    muestra) y cuántos de ellos encuentra el índice. Devuelve recall,
+    precisión y tiempos.
+    """
+    lsh = MinHashLSH(threshold, num_perm=num_perm)
+
+    started = time.perf_counter()
+    shingles = [lsh.shingles(text) for text in texts]
+    exact = set()
+    for i in range(len(texts)):
+        for j in range(i + 1, len(texts)):
+            if lsh.similarity(shingles[i], shingles[j]) >= threshold:
+                exact.add((i, j))
+    exact_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    found = set()
+    for j, text in enumerate(texts):
+        sketch = lsh.sketch(text)
+        found.update((i, j) for i, _ in lsh.matches(sketch))
+        lsh.insert(j, sketch)
+    lsh_seconds = time.perf_counter() - started
+
+    true_positives = len(found & exact)
+    return {
+        "pairs_exact": len(exact),
+        "pairs_lsh": len(found),
+        "recall": true_positives / len(exact) if exact else 1.0,
+        "precision": true_positives / len(found) if found else 1.0,
+        "exact_seconds": exact_seconds,
+        "lsh_seconds": lsh_seconds,
+    }
+
+class InputDeduplicator:
+    """Agrupa registros con el mismo Titulo/Comentario normalizado.
+
+    El primer registro de cada grupo es el representante y es el único que se
+    envía al modelo; los demás esperan su análisis. Con `lsh` (MinHashLSH) un
+    registro nuevo se une además al grupo de un representante casi idéntico.
+    Los análisis se guardan para `max_results` grupos (LRU); al expulsar uno
+    también sale del índice LSH, así la memoria no crece con la tabla.
+    Solo lo usa el hilo que reparte el trabajo, así que no necesita bloqueos.
+    """
+
+    def __init__(self, max_results=DEDUP_MAX_RESULTS, lsh=None):
+        self.max_results = max_results
+        self.lsh = lsh
+        self._waiting = {}
+        self._results = OrderedDict()
+        self.groups = 0
+        self.saved_calls = 0
+        self.near_duplicates = 0
+
+    @staticmethod
+    def key(row):
+        text = normalize_text(row["Titulo"]) + "\x1f" + normalize_text(row["Comentario"])
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def add(self, row):
+        """Registra una fila. Devuelve (clave, análisis ya conocido o None, si es representante)"""
+        key = self.key(row)
+        if self.lsh and key not in self._results and key not in self._waiting:
+            sketch = self.lsh.sketch(f"{row['Titulo']} {row['Comentario']}")
+            match = self.lsh.query(sketch)
+            if match is not None and (match in self._results or match in self._waiting):
+                key = match
+                self.near_duplicates += 1
+            else:
+                self.lsh.insert(key, sketch)
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.saved_calls += 1
+            return key, self._results[key], False
+        if key in self._waiting:
+            self._waiting[key].append(row)
+            self.saved_calls += 1
+            return key, None, False
+        self._waiting[key] = []
+        self.groups += 1
+        return key, None, True
+
+    def complete(self, key, analysis):
+        """Guarda el análisis del representante y devuelve las filas que lo esperaban"""
+        self._results[key] = analysis
+        waiting = self._waiting.pop(key, [])
+        if len(self._results) > self.max_results:
+            evicted, _ = self._results.popitem(last=False)
+            if self.lsh and evicted not in self._waiting:
+                self.lsh.remove(evicted)
+        return waiting
+
+# Bloque de instrucciones común a todos los prompts (no depende del registro)
+PROMPT_PREFIX = """
             Dado un [Titulo] y [Comentario] sobre una observación relacionada con las etiquetas de banano destinadas a la exportación a Japón, realizar un análisis exhaustivo y adaptativo que explore todos los aspectos posibles. El objetivo principal es identificar las causas del problema de legibilidad de las etiquetas por los lectores en Japón. Este análisis debe:
 
             1. Analizar el problema central
@@ -135,38 +2037,823 @@ def analyze_banana_labels(event=None, context=None):
             
             La escritura tiene que estar bien redactada, con coherencia y cohesión. Se debe utilizar un lenguaje técnico y profesional. NO SE COLOCA #, ##, ### o cualquier otro tipo de formato. SOLO POR ESPACIADO PARA SEPARAR PÁRRAFOS.
 
-            [Titulo]: {titulo} 
+"""
+
+def build_prompt(titulo, comentario):
+    """Construye el prompt de análisis para un registro"""
+    return PROMPT_PREFIX + f"""            [Titulo]: {titulo} 
             [Comentario]: {comentario}
             """
 
-            # Generar análisis con Gemini y manejar la respuesta
-            response = model.generate_content(prompt)
-            if response.candidates:
-                analysis = response.candidates[0].text
+
+def build_packed_prompt(rows):
+    """Construye un prompt que pide el análisis de varios registros en un arreglo JSON"""
+    records = "\n\n".join(
+        f"            [Id]: {row['Id']}\n"
+        f"            [Titulo]: {row['Titulo']}\n"
+        f"            [Comentario]: {row['Comentario']}"
+        for row in rows
+    )
+    return PROMPT_PREFIX + f"""            A continuación hay {len(rows)} registros, cada uno identificado por su [Id]. Realizar el análisis anterior para cada registro por separado.
+
+            Responder ÚNICAMENTE con un arreglo JSON válido, sin texto adicional, con un objeto por registro de la forma {{"id": "<Id>", "analisis": "<texto del análisis>"}}, usando exactamente el [Id] de cada registro. El texto del análisis sigue las reglas de redacción anteriores.
+
+{records}
+            """
+
+def parse_packed_response(text, expected_ids):
+    """Extrae {Id: análisis} de la respuesta de un paquete, descartando entradas inválidas"""
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        return {}
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    expected = set(expected_ids)
+    analyses = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        record_id = str(item.get("id", "")).strip()
+        analysis = item.get("analisis")
+        if record_id in expected and record_id not in analyses and isinstance(analysis, str) and analysis.strip():
+            analyses[record_id] = analysis.strip()
+    return analyses
+
+def is_prefix_unsupported_error(error):
+    """Indica si el modelo rechazó el prefijo y conviene enviar prompts completos.
+
+    NotFound/FailedPrecondition (404/412) indican que el contenido en caché ya
+    no existe o no se puede usar; un InvalidArgument (400) solo cuenta si el
+    mensaje menciona el contenido en caché o system_instruction.
+    """
+    name = type(error).__name__
+    code = getattr(error, "code", None)
+    try:
+        code = int(code)
+    except (TypeError, ValueError):
+        code = None
+    if name in ("NotFound", "FailedPrecondition") or code in (404, 412):
+        return True
+    if name in ("InvalidArgument", "BadRequest") or code == 400:
+        message = str(error).lower()
+        return any(marker in message for marker in PREFIX_ERROR_MARKERS)
+    return False
+
+class PrefixCachedModel:
+    """Modelo que envía solo la parte variable de los prompts que empiezan por el prefijo.
+
+    `mode` es "cached_content" (prefijo registrado en la caché de contexto),
+    "system_instruction" o "full". Si el modelo con prefijo rechaza una
+    llamada (p. ej. la caché caducó o el modelo no admite system_instruction)
+    se pasa a "full" para el resto de la ejecución y se repite la llamada.
+    """
+
+    def __init__(self, full_model, prefixed_model, prefix, mode, cached_content=None):
+        self.full_model = full_model
+        self.prefixed_model = prefixed_model
+        self.prefix = prefix
+        self.mode = mode
+        self.cached_content = cached_content
+        self.prefix_tokens = estimate_tokens(prefix)
+        self.calls_with_prefix = 0
+        self.calls_full = 0
+        self.cached_tokens_reported = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs):
+        if self.mode != "full" and prompt.startswith(self.prefix):
+            try:
+                response = self.prefixed_model.generate_content(prompt[len(self.prefix):], **kwargs)
+            except Exception as e:
+                if not is_prefix_unsupported_error(e):
+                    raise e
+                with self._lock:
+                    if self.mode != "full":
+                        print(f"El prefijo en caché no está disponible ({str(e)}); se envían prompts completos")
+                        self.mode = "full"
             else:
-                analysis = response.text
+                usage = getattr(response, "usage_metadata", None)
+                cached = getattr(usage, "cached_content_token_count", None)
+                with self._lock:
+                    self.calls_with_prefix += 1
+                    if isinstance(cached, int):
+                        self.cached_tokens_reported += cached
+                return response
+        with self._lock:
+            self.calls_full += 1
+        return self.full_model.generate_content(prompt, **kwargs)
 
-            # Guardar en info_detalle
-            output_row = {
-                "id_original": str(row["Id"]),
-                "titulo": titulo,
-                "analisis": analysis
-            }
-            
-            table_ref = bq_client.dataset(BQ_DATASET).table(BQ_OUTPUT_TABLE)
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "calls_with_prefix": self.calls_with_prefix,
+            "calls_full": self.calls_full,
+            "prefix_tokens_not_sent": self.calls_with_prefix * self.prefix_tokens,
+            "cached_tokens_reported": self.cached_tokens_reported,
+        }
+
+    def close(self):
+        """Elimina el contenido en caché creado para esta ejecución"""
+        if self.cached_content is not None:
             try:
-                errors = insert_with_retry(table_ref, [output_row])
-                if errors:
-                    print(f"Error al guardar análisis: {errors}")
-                else:
-                    print(f"✓ Análisis guardado para ID: {row['Id']}")
+                self.cached_content.delete()
             except Exception as e:
-                print(f"Error al intentar guardar el análisis: {str(e)}")
+                print(f"No se pudo eliminar el contenido en caché: {str(e)}")
+            self.cached_content = None
+
+def create_prefix_model(model_name=MODEL_NAME, prefix=PROMPT_PREFIX):
+    """Registra el prefijo común una vez y devuelve un PrefixCachedModel"""
+    full_model = get_generative_model(model_name)
+    try:
+        from vertexai.preview import caching
+        cached_content = caching.CachedContent.create(
+            model_name=model_name,
+            system_instruction=prefix,
+            ttl=PREFIX_CACHE_TTL,
+        )
+        from vertexai.preview.generative_models import GenerativeModel
+        prefixed_model = GenerativeModel.from_cached_content(cached_content=cached_content)
+        print("✓ Prefijo del prompt registrado en la caché de contexto de Vertex AI")
+        return PrefixCachedModel(full_model, prefixed_model, prefix, "cached_content", cached_content)
+    except Exception as e:
+        print(f"Caché de contexto no disponible ({str(e)}); se usa system_instruction")
+    try:
+        prefixed_model = get_generative_model(model_name, system_instruction=[prefix])
+        return PrefixCachedModel(full_model, prefixed_model, prefix, "system_instruction")
+    except Exception as e:
+        print(f"system_instruction no disponible ({str(e)}); se envían prompts completos")
+        return PrefixCachedModel(full_model, None, prefix, "full")
+
+def generate_analysis(model, prompt, limiter=None, controller=None, cache=None,
+                      expected_output_tokens=ESTIMATED_OUTPUT_TOKENS):
+    """Genera el análisis con Gemini y extrae el texto de la respuesta"""
+    if cache:
+        cache_key = ResponseCache.make_key(prompt)
+        cached = cache.get(cache_key)
+        metrics.inc("cache_misses" if cached is None else "cache_hits")
+        if cached is not None:
+            return cached
+
+    limiter = limiter or rate_limiter
+    reserved = estimate_tokens(prompt) + expected_output_tokens
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        if controller:
+            controller.acquire()
+        limiter.acquire(reserved)
+        started = time.monotonic()
+        try:
+            attributes = {"gen_ai.request.model": MODEL_NAME, "infoia.attempt": attempt}
+            with trace_span("generate_content", attributes) as span:
+                with metrics.timer("generate"):
+                    response = model.generate_content(prompt, generation_config=GENERATION_CONFIG)
+                if response.candidates:
+                    analysis = response.candidates[0].text
+                else:
+                    analysis = response.text
+                input_tokens, output_tokens = response_token_usage(response, prompt, analysis)
+                span.set_attribute("gen_ai.usage.input_tokens", input_tokens)
+                span.set_attribute("gen_ai.usage.output_tokens", output_tokens)
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            if controller:
+                controller.release(time.monotonic() - started, "throttled" if throttled else "error")
+            if not throttled or attempt == MAX_THROTTLE_RETRIES:
                 raise e
+            metrics.inc("generate_retries")
+            time.sleep(min(60, 2 ** attempt) * random.uniform(0.5, 1.5))  # Espera exponencial con jitter
+            continue
+        if controller:
+            controller.release(time.monotonic() - started, "ok")
+        break
+
+    actual = response_token_count(response)
+    if actual is not None:
+        limiter.record_usage(reserved, actual)
+    metrics.inc("input_tokens", input_tokens)
+    metrics.inc("output_tokens", output_tokens)
+    if cache:
+        cache.put(cache_key, analysis)
+    return analysis
+
+def build_output_row(row, analysis):
+    """Fila de info_detalle para un registro de Info"""
+    return {
+        "id_original": str(row["Id"]),
+        "titulo": row['Titulo'],
+        "analisis": analysis
+    }
+
+def analyze_row(model, row, controller=None, cache=None):
+    """Analiza un registro de Info y devuelve la fila para info_detalle"""
+    titulo = row['Titulo']
+    comentario = row['Comentario']
+    print(f"\nAnalizando registro con título: {titulo}")
+
+    with metrics.timer("prompt_build"):
+        prompt = build_prompt(titulo, comentario)
+    analysis = generate_analysis(model, prompt, controller=controller, cache=cache)
+    return build_output_row(row, analysis)
+
+class RecordPacker:
+    """Agrupa registros en paquetes que caben en los presupuestos de tokens.
+
+    Un paquete se cierra al llegar a `max_records` o cuando el siguiente
+    registro superaría `input_token_budget`; `max_records` se limita además a
+    los análisis que caben en `output_token_budget`.
+    """
+
+    def __init__(self, max_records=PACK_MAX_RECORDS, input_token_budget=PACK_INPUT_TOKEN_BUDGET,
+                 output_token_budget=PACK_OUTPUT_TOKEN_BUDGET):
+        self.max_records = max(1, min(max_records, output_token_budget // ESTIMATED_OUTPUT_TOKENS))
+        self.input_token_budget = input_token_budget
+        self._pack = []
+        self._tokens = 0
+
+    def add(self, row, key=None):
+        """Añade un registro; devuelve la lista de paquetes (row, key) que quedaron completos"""
+        tokens = estimate_tokens(f"{row['Id']} {row['Titulo']} {row['Comentario']}")
+        packs = []
+        if self._pack and self._tokens + tokens > self.input_token_budget:
+            packs.append(self.flush())
+        self._pack.append((row, key))
+        self._tokens += tokens
+        if len(self._pack) >= self.max_records:
+            packs.append(self.flush())
+        return packs
+
+    def flush(self):
+        pack = self._pack
+        self._pack = []
+        self._tokens = 0
+        return pack
+
+def analyze_pack(model, rows, controller=None, cache=None):
+    """Analiza varios registros en una sola llamada y devuelve sus filas en el mismo orden.
+
+    Los registros que falten o sean inválidos en la respuesta JSON se
+    analizan después uno a uno.
+    """
+    if len(rows) == 1:
+        return [analyze_row(model, rows[0], controller, cache)]
+
+    print(f"\nAnalizando paquete de {len(rows)} registros")
+    with metrics.timer("prompt_build"):
+        prompt = build_packed_prompt(rows)
+    response_text = generate_analysis(model, prompt, controller=controller, cache=cache,
+                                      expected_output_tokens=ESTIMATED_OUTPUT_TOKENS * len(rows))
+    analyses = parse_packed_response(response_text, [str(row["Id"]) for row in rows])
+    if len(analyses) < len(rows):
+        print(f"Paquete incompleto: {len(rows) - len(analyses)} registros se analizarán individualmente")
+
+    output_rows = []
+    for row in rows:
+        analysis = analyses.get(str(row["Id"]))
+        if analysis is None:
+            output_rows.append(analyze_row(model, row, controller, cache))
+        else:
+            output_rows.append(build_output_row(row, analysis))
+    return output_rows
+
+def generate_concurrently(model, rows, max_concurrency=MAX_CONCURRENT_REQUESTS, controller=None, cache=None,
+                          dedup=None, packer=None, stage=None):
+    """Genera los análisis en paralelo con un límite de solicitudes en vuelo.
+
+    Produce las filas de salida a medida que terminan (no en el orden de
+    entrada); el conjunto de filas es el mismo que con el bucle secuencial.
+    Si una generación falla, la excepción se propaga como antes. Con un
+    `controller` adaptativo, max_concurrency es solo el techo de hilos y el
+    controlador decide cuántas llamadas al modelo hay realmente en vuelo.
+    Con `dedup` (InputDeduplicator) solo se analiza un registro por grupo de
+    duplicados y su análisis se escribe para todos los Id del grupo. Con
+    `packer` (RecordPacker) cada llamada analiza un paquete de registros.
+    Con `stage` se registran los registros analizados, la ocupación de los
+    hilos y las tareas pendientes (en vuelo o esperando hilo).
+    """
+    max_concurrency = max(1, int(max_concurrency))
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pending = {}
+
+        def finished(done):
+            for future in done:
+                keys = pending.pop(future)
+                if stage:
+                    stage.set_queue_depth(len(pending))
+                for key, output_row in zip(keys, future.result()):
+                    yield output_row
+                    if dedup:
+                        for member in dedup.complete(key, output_row["analisis"]):
+                            yield build_output_row(member, output_row["analisis"])
+
+        def submit(pack):
+            if len(pending) >= max_concurrency:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+            pack_rows = [row for row, _ in pack]
+            pending[executor.submit(timed_analyze_pack, pack_rows)] = [key for _, key in pack]
+            if stage:
+                stage.set_queue_depth(len(pending))
+
+        def timed_analyze_pack(pack_rows):
+            started = time.monotonic()
+            try:
+                ids = [str(row["Id"]) for row in pack_rows]
+                with trace_span("analyze_row", {"infoia.id_original": ids[0] if len(ids) == 1 else ids}):
+                    return analyze_pack(model, pack_rows, controller, cache)
+            finally:
+                if stage:
+                    stage.record(time.monotonic() - started, len(pack_rows))
+
+        for row in rows:
+            key = None
+            if dedup:
+                key, analysis, representative = dedup.add(row)
+                if analysis is not None:
+                    yield build_output_row(row, analysis)
+                if not representative:
+                    continue
+            packs = packer.add(row, key) if packer else [[(row, key)]]
+            for pack in packs:
+                yield from submit(pack)
+
+        if packer:
+            last_pack = packer.flush()
+            if last_pack:
+                yield from submit(last_pack)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+
+def build_batch_request(prompt):
+    """Solicitud GenerateContent en el formato JSON de la predicción por lotes"""
+    request = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+    if GENERATION_CONFIG:
+        request["generationConfig"] = GENERATION_CONFIG
+    return request
+
+def wait_for_batch_job(job, clock=None, initial_delay=BATCH_POLL_INITIAL_SECONDS,
+                       max_delay=BATCH_POLL_MAX_SECONDS, timeout=BATCH_POLL_TIMEOUT_SECONDS):
+    """Consulta el estado del job con espera exponencial hasta que termine o venza el plazo"""
+    clock = clock or SystemClock()
+    deadline = clock.now() + timeout
+    delay = initial_delay
+    while True:
+        job.refresh()
+        if job.has_ended:
+            return job
+        if clock.now() + delay > deadline:
+            raise Exception(f"El job por lotes no terminó en {timeout} segundos (estado: {job.state})")
+        print(f"Job por lotes en estado {job.state}; nueva consulta en {delay:.0f}s")
+        clock.sleep(delay)
+        delay = min(max_delay, delay * 2)
+
+class VertexBatchJobRunner:
+    """Ejecuta las solicitudes con un job de predicción por lotes de Vertex AI.
+
+    Carga las solicitudes en una tabla de staging de BigQuery (las columnas
+    id_original, titulo y comentario pasan tal cual a la salida), envía el
+    job, espera a que termine y lee las respuestas de la tabla de salida.
+    Las tablas de staging se borran al terminar.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, clock=None):
+        self.model_name = model_name
+        self.clock = clock
+
+    def run(self, requests):
+        run_id = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        input_table = f"{PROJECT_ID}.{BQ_DATASET}.{BQ_BATCH_TABLE_PREFIX}_input_{run_id}"
+        output_table = f"{PROJECT_ID}.{BQ_DATASET}.{BQ_BATCH_TABLE_PREFIX}_output_{run_id}"
+        from google.cloud import bigquery
+        schema = [
+            bigquery.SchemaField("id_original", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("titulo", "STRING"),
+            bigquery.SchemaField("comentario", "STRING"),
+            bigquery.SchemaField("request", "JSON", mode="REQUIRED"),
+        ]
+        try:
+            with LoadJobWriter(input_table, schema=schema) as staging:
+                for request in requests:
+                    staging.write(request)
+            if not staging.rows_written:
+                return
+
+            from vertexai.batch_prediction import BatchPredictionJob
+            job = BatchPredictionJob.submit(
+                source_model=self.model_name,
+                input_dataset=f"bq://{input_table}",
+                output_uri_prefix=f"bq://{output_table}",
+            )
+            print(f"Job de predicción por lotes enviado: {job.resource_name}")
+            wait_for_batch_job(job, self.clock)
+            if not job.has_succeeded:
+                raise Exception(f"El job por lotes terminó con estado {job.state}: {job.error}")
+            print(f"✓ Job por lotes completado; leyendo resultados de {output_table}")
+
+            query = f"""
+                SELECT id_original, titulo, comentario,
+                       JSON_VALUE(response, '$.candidates[0].content.parts[0].text') AS analisis
+                FROM `{output_table}`
+            """
+            yield from QueryRowStream(get_bq_client().query(query))
+        finally:
+            for table_id in (input_table, output_table):
+                get_bq_client().delete_table(table_id, not_found_ok=True)
+
+def generate_batch(rows, runner, model, max_concurrency=MAX_CONCURRENT_REQUESTS, controller=None, cache=None,
+                   stage=None):
+    """Genera los análisis con un job por lotes y produce las filas de info_detalle.
+
+    Los registros que vuelven sin análisis válido se reintentan en línea con
+    generate_concurrently al final.
+    """
+    requests = ({
+        "id_original": str(row["Id"]),
+        "titulo": row["Titulo"],
+        "comentario": row["Comentario"],
+        "request": build_batch_request(build_prompt(row["Titulo"], row["Comentario"])),
+    } for row in rows)
+
+    failed = []
+    for result in runner.run(requests):
+        if result["analisis"]:
+            yield {
+                "id_original": result["id_original"],
+                "titulo": result["titulo"],
+                "analisis": result["analisis"],
+            }
+        else:
+            failed.append({"Id": result["id_original"], "Titulo": result["titulo"], "Comentario": result["comentario"]})
+
+    if failed:
+        print(f"{len(failed)} registros sin respuesta del job por lotes; se analizarán en línea")
+        yield from generate_concurrently(model, failed, max_concurrency, controller, cache, stage=stage)
+
+class Deadline:
+    """Plazo de una invocación con presupuesto de tiempo.
+
+    expired() se vuelve verdadero `drain_margin` segundos antes del final,
+    para que quede tiempo de vaciar las llamadas en vuelo y los lotes
+    pendientes. limit(rows) deja de producir filas al vencer el plazo y marca
+    `cut` para saber que la ejecución quedó a medias.
+    """
+
+    def __init__(self, budget_seconds, drain_margin=DEADLINE_DRAIN_MARGIN_SECONDS, clock=None):
+        self.clock = clock or SystemClock()
+        self.budget_seconds = budget_seconds
+        self.drain_margin = min(drain_margin, budget_seconds / 2)
+        self.started = self.clock.now()
+        self.cut = False
+
+    def remaining(self):
+        return self.budget_seconds - (self.clock.now() - self.started)
+
+    def expired(self):
+        return self.remaining() <= self.drain_margin
+
+    def limit(self, rows):
+        iterator = iter(rows)
+        try:
+            # Se comprueba el plazo antes de pedir la fila siguiente, así no se
+            # toma (ni se arrienda) ninguna fila que luego no se procese
+            while not self.expired():
+                try:
+                    row = next(iterator)
+                except StopIteration:
+                    return
+                yield row
+            self.cut = True
+            print(f"Plazo alcanzado ({self.remaining():.0f} s restantes): "
+                  "no se toman más registros, vaciando lo pendiente...")
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()  # Detiene los hilos lectores
+
+def encode_continuation_event(token):
+    """Evento con el formato de Pub/Sub (`data` en base64) que lleva el token"""
+    return {"data": base64.b64encode(json.dumps(token).encode("utf-8")).decode("ascii")}
+
+def decode_continuation_token(event):
+    """Token de continuación del evento, o None si es una invocación inicial"""
+    if not event or not event.get("data"):
+        return None
+    try:
+        payload = json.loads(base64.b64decode(event["data"]).decode("utf-8"))
+    except ValueError:
+        return None
+    if isinstance(payload, dict) and "continuation" in payload:
+        return payload
+    return None
+
+class PubSubContinuationTrigger:
+    """Publica la continuación en CONTINUATION_TOPIC para volver a disparar la función"""
+
+    def __init__(self, topic=CONTINUATION_TOPIC, project=PROJECT_ID):
+        from google.cloud import pubsub_v1
+        self.publisher = pubsub_v1.PublisherClient()
+        self.topic_path = self.publisher.topic_path(project, topic)
+
+    def publish(self, token):
+        data = json.dumps(token).encode("utf-8")
+        message_id = self.publisher.publish(self.topic_path, data).result()
+        print(f"✓ Continuación {token['continuation']} publicada en {self.topic_path} ({message_id})")
+
+class LocalContinuationTrigger:
+    """Sustituto local de PubSubContinuationTrigger para pruebas sin conexión.
+
+    Guarda los eventos publicados; run_pending() los entrega uno a uno a
+    analyze_banana_labels en el mismo proceso, como haría la suscripción.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.delivered = 0
+
+    def publish(self, token):
+        self.events.append(encode_continuation_event(token))
+        print(f"✓ Continuación {token['continuation']} encolada localmente")
+
+    def run_pending(self, **kwargs):
+        while self.events:
+            event = self.events.pop(0)
+            self.delivered += 1
+            analyze_banana_labels(event, None, continuation_trigger=self, **kwargs)
+
+def shard_filter(shard_index, shard_count, column="i.Id"):
+    """Condición SQL que deja solo los Id del fragmento `shard_index` de `shard_count`"""
+    shard_index, shard_count = int(shard_index), int(shard_count)
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Fragmento inválido: {shard_index} de {shard_count}")
+    # ABS después del MOD: ABS del mínimo INT64 desbordaría
+    return f"ABS(MOD(FARM_FINGERPRINT(CAST({column} AS STRING)), {shard_count})) = {shard_index}"
+
+def build_input_query(full_rebuild=FULL_REBUILD, shard_index=0, shard_count=1):
+    """Consulta de los registros de Info a analizar.
+
+    En modo incremental se excluyen (anti-join) los Id que ya tienen análisis
+    en info_detalle; en reconstrucción completa se leen todos. Con
+    `shard_count` > 1 solo se leen los Id del fragmento `shard_index`.
+    """
+    query = f"""
+            SELECT i.Id, i.Titulo, i.Comentario
+            FROM `{PROJECT_ID}.{BQ_DATASET}.{BQ_INPUT_TABLE}` AS i
+        """
+    conditions = []
+    if not full_rebuild:
+        conditions.append(f"""NOT EXISTS (
+                SELECT 1
+                FROM `{PROJECT_ID}.{BQ_DATASET}.{BQ_OUTPUT_TABLE}` AS d
+                WHERE d.id_original = CAST(i.Id AS STRING)
+            )""")
+    if shard_count > 1:
+        conditions.append(shard_filter(shard_index, shard_count))
+    if conditions:
+        query += "    WHERE " + "\n              AND ".join(conditions) + "\n        "
+    return query
+
+def analyze_banana_labels(event=None, context=None, max_concurrency=MAX_CONCURRENT_REQUESTS,
+                          output_backend=OUTPUT_BACKEND, input_reader=INPUT_READER,
+                          full_rebuild=FULL_REBUILD, use_cache=RESPONSE_CACHE_ENABLED,
+                          deduplicate=DEDUPLICATE_INPUTS, near_dedup_threshold=NEAR_DEDUP_THRESHOLD,
+                          pack_records=PACK_RECORDS, prefix_caching=PREFIX_CACHING,
+                          generation_mode=GENERATION_MODE, batch_runner=None, checkpoint=CHECKPOINT_ENABLED,
+                          time_budget=TIME_BUDGET_SECONDS, continuation_trigger=None, clock=None,
+                          shard_index=SHARD_INDEX, shard_count=SHARD_COUNT, model=None, work_queue=None,
+                          metrics_file=METRICS_FILE, metrics_format=METRICS_FORMAT, tracing=TRACING_EXPORTER):
+    """Punto de entrada (Cloud Functions con disparador de Pub/Sub o local).
+
+    Con `time_budget` la invocación deja de tomar registros antes del plazo,
+    vacía lo pendiente y publica un token de continuación con
+    `continuation_trigger` (Pub/Sub por defecto). Un evento que trae ese token
+    continúa en modo incremental. Devuelve el token publicado o None. `clock`
+    (p. ej. FakeClock) mide el plazo en lugar del reloj del sistema.
+    Con `shard_count` > 1 solo se procesa el fragmento `shard_index` de Info.
+    `model` permite inyectar un modelo (p. ej. el falso de infoia_local). Con
+    `work_queue` (WorkQueue) los registros de la consulta se agregan a la cola
+    y se procesan los que este trabajador logre reclamar. Con `metrics_file`
+    las métricas de la ejecución se exportan en `metrics_format`, también si falla.
+    Con `tracing` ("otlp" o "file") cada ejecución es una traza con un span por
+    registro y por llamada a generate_content e insert_rows_json.
+    """
+    metrics.reset()
+    if tracing and _tracer is None:
+        configure_tracing(tracing)
+    run_span = start_run_trace({"infoia.full_rebuild": full_rebuild, "infoia.shard_index": shard_index,
+                                "infoia.shard_count": shard_count})
+    failure = None
+    try:
+        deadline = Deadline(time_budget, clock=clock) if time_budget else None
+        token = decode_continuation_token(event)
+        if token:
+            # Lo ya guardado en invocaciones anteriores lo excluye el anti-join
+            full_rebuild = False
+            shard_index = token.get("shard_index", shard_index)
+            shard_count = token.get("shard_count", shard_count)
+            print(f"Continuación {token['continuation']} de la ejecución {token.get('run_id')} "
+                  f"({token.get('rows_written', 0)} registros guardados hasta ahora)")
+
+        if work_queue and shard_count > 1:
+            # La cola ya reparte los Id: cada trabajador lee toda la tabla
+            print(f"Cola de trabajo: se ignora el fragmento {shard_index + 1} de {shard_count}")
+            shard_index, shard_count = 0, 1
+        if shard_count > 1:
+            if full_rebuild:
+                # Cada tarea borraría la tabla que las demás ya están llenando
+                raise ValueError("La reconstrucción completa no admite fragmentos: recrea info_detalle "
+                                 "antes (ver CREATE OR REPLACE al final) y lanza los fragmentos en modo incremental")
+            print(f"Fragmento {shard_index + 1} de {shard_count}")
+        # La cuota es del proyecto: cada fragmento o trabajador usa solo su parte
+        share_quota(work_queue.workers if work_queue else shard_count)
+        if work_queue and full_rebuild:
+            raise ValueError("La reconstrucción completa no admite cola de trabajo: recrea info_detalle "
+                             "antes y lanza los trabajadores en modo incremental")
+
+        # Con cola de trabajo el estado done de cada Id ya hace de diario, y
+        # varios trabajadores en la misma máquina se pisarían el fichero
+        journal = CheckpointJournal(checkpoint_path(shard_index, shard_count)) \
+            if checkpoint and not work_queue else None
+        if journal and journal.resumed and not token and journal.full_rebuild != full_rebuild:
+            # Una reconstrucción completa explícita no se degrada a incremental
+            # por el diario de una ejecución incremental caída (ni al revés)
+            print(f"Se descarta el diario de la ejecución {journal.run_id}: era de otro modo")
+            journal.discard()
+        if journal and journal.resumed:
+            # La tabla ya se reconstruyó en la ejecución interrumpida: no se
+            # vuelve a borrar y el anti-join excluye lo que ya se guardó
+            full_rebuild = False
+
+        with metrics.timer("verify"):
+            verified = verify_bigquery_resources(full_rebuild)
+        if not verified:
+            raise Exception("Falló la verificación de recursos de BigQuery")
+        # El diario empieza una vez verificada (y, si toca, recreada) la tabla:
+        # una verificación fallida no deja una ejecución a medias que reanudar
+        if journal:
+            journal.start(full_rebuild)
+
+        query = build_input_query(full_rebuild, shard_index, shard_count)
+        
+        modo = "reconstrucción completa" if full_rebuild else "incremental"
+        print(f"Consultando registros de la tabla Info (modo {modo})...")
+        read_stage = StageStats("lectura", 1, INPUT_QUEUE_MAX_PAGES)
+        generate_stage = StageStats("generación", max_concurrency, max_concurrency)
+        write_stage = StageStats("escritura", WRITE_WORKERS, WRITE_QUEUE_MAX_BATCHES)
+        with metrics.timer("query"):
+            # Incluye la espera del job: el flujo de entrada pide su resultado
+            query_job = get_bq_client().query(query)
+            rows = open_input_stream(query_job, input_reader, read_stage)
+        
+        print(f"Se encontraron {rows.total_rows} registros para analizar")
+        input_rows = rows
+        if journal and journal.completed:
+            input_rows = (row for row in rows if not journal.is_completed(str(row["Id"])))
+        if work_queue:
+            added = work_queue.seed(input_rows)
+            print(f"Cola de trabajo: {added} registros nuevos, estado {work_queue.counts()} "
+                  f"(trabajador {work_queue.owner})")
+            input_rows = work_queue.iter_rows()
+        if deadline:
+            input_rows = deadline.limit(input_rows)
+
+        # Inicializar el modelo Gemini correctamente
+        if model is None:
+            model = create_prefix_model() if prefix_caching else get_generative_model(MODEL_NAME)
+        table_ref = get_bq_client().dataset(BQ_DATASET).table(BQ_OUTPUT_TABLE)
+        controller = AdaptiveConcurrencyController(max_limit=max_concurrency)
+        cache = get_response_cache() if use_cache else None
+        if cache:
+            cache.reset_stats()
+        dedup = None
+        if deduplicate:
+            lsh = MinHashLSH(near_dedup_threshold) if near_dedup_threshold else None
+            dedup = InputDeduplicator(lsh=lsh)
+        packer = RecordPacker() if pack_records else None
+
+        if generation_mode == "auto":
+            # Un job por lotes no se puede cortar a tiempo ni renovar arrendamientos
+            # por registro: con plazo o cola de trabajo se genera en línea
+            batch = not (deadline or work_queue) and (rows.total_rows or 0) >= BATCH_PREDICTION_ROW_THRESHOLD
+            generation_mode = "batch" if batch else "online"
+        if generation_mode == "batch" and (deadline or work_queue):
+            raise ValueError("El modo por lotes no admite presupuesto de tiempo ni cola de trabajo")
+        print(f"Modo de generación: {generation_mode}")
+        run_span.set_attribute("infoia.generation_mode", generation_mode)
+        if generation_mode == "batch":
+            output_rows = generate_batch(input_rows, batch_runner or VertexBatchJobRunner(), model,
+                                         max_concurrency, controller, cache, generate_stage)
+        elif generation_mode == "online":
+            output_rows = generate_concurrently(model, input_rows, max_concurrency, controller, cache, dedup, packer,
+                                                generate_stage)
+        else:
+            raise ValueError(f"Modo de generación desconocido: {generation_mode}")
+
+        commit_hooks = [hook for hook in (journal and journal.mark_committed,
+                                          work_queue and work_queue.complete) if hook]
+
+        def on_commit(ids):
+            for hook in commit_hooks:
+                hook(ids)
+
+        monitor = PipelineMonitor([read_stage, generate_stage, write_stage]).start()
+        if work_queue:
+            work_queue.start()
+        try:
+            with create_output_writer(table_ref, rows.total_rows or 0, output_backend, write_stage,
+                                      on_commit if commit_hooks else None) as writer:
+                for output_row in output_rows:
+                    writer.write(output_row)
+        finally:
+            monitor.stop()
+            if work_queue:
+                work_queue.stop()
+            if isinstance(model, PrefixCachedModel):
+                model.close()
+        cut = deadline is not None and deadline.cut
+        if journal and not cut:
+            journal.finish()
+
+        metrics.inc("rows_written", writer.rows_written)
+        run_span.set_attribute("infoia.rows_written", writer.rows_written)
+        metrics.inc("rows_dead_lettered", writer.rows_failed)
+        print(f"✓ {writer.rows_written} análisis guardados en {writer.batches_written} lotes")
+        if writer.rows_failed:
+            print(f"{writer.rows_failed} filas enviadas a filas muertas: {dead_letter_sink.path}")
+        print(f"Concurrencia adaptativa: {controller.metrics()}")
+        if dedup:
+            print(f"Deduplicación: {dedup.groups} registros únicos, "
+                  f"{dedup.saved_calls} llamadas al modelo evitadas "
+                  f"({dedup.near_duplicates} por casi duplicados)")
+        if cache:
+            print(f"Caché de respuestas: {cache.hits} aciertos, {cache.misses} fallos "
+                  f"(tasa de acierto {cache.hit_rate():.1%})")
+        if isinstance(model, PrefixCachedModel):
+            print(f"Prefijo en caché: {model.stats()}")
+        if work_queue:
+            print(f"Cola de trabajo: {work_queue.claimed} registros reclamados por este trabajador, "
+                  f"estado {work_queue.counts()}")
+        metrics.report()
+
+        if not cut:
+            return None
+        if not writer.rows_written:
+            raise Exception("El plazo venció sin guardar ningún registro; aumenta TIME_BUDGET_SECONDS")
+        run_id = (token or {}).get("run_id") or (journal.run_id if journal else
+                                                 datetime.utcnow().strftime("%Y%m%dT%H%M%S"))
+        next_token = {
+            "continuation": (token or {}).get("continuation", 0) + 1,
+            "run_id": run_id,
+            "rows_written": (token or {}).get("rows_written", 0) + writer.rows_written,
+            "shard_index": shard_index,
+            "shard_count": shard_count,
+        }
+        (continuation_trigger or PubSubContinuationTrigger()).publish(next_token)
+        return next_token
 
     except Exception as e:
+        failure = e
         print(f"Error general: {str(e)}")
         raise e
+    finally:
+        end_run_trace(run_span, failure)
+        if metrics_file:
+            metrics.export(metrics_file, metrics_format)
+
+def benchmark_startup(runs=5, model_call=False):
+    """Mide el arranque en frío en procesos nuevos (mediana de `runs` ejecuciones).
+
+    - import_infoia: importar este módulo (ahora sin bibliotecas de Google).
+    - import_google: importar google.cloud.bigquery y vertexai, el costo que
+      antes se pagaba en cada import.
+    - first_model_call (con model_call=True): crear clientes y hacer la primera
+      llamada al modelo; requiere credenciales válidas.
+    """
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    timed = "import time; t = time.perf_counter(); {}; print(time.perf_counter() - t)"
+    cases = {
+        "import_infoia": timed.format("import infoia"),
+        "import_google": timed.format("import google.cloud.bigquery, vertexai.preview.generative_models"),
+    }
+    if model_call:
+        cases["first_model_call"] = (
+            "import time, infoia; t = time.perf_counter(); infoia.get_bq_client(); "
+            "infoia.get_generative_model().generate_content('ping'); print(time.perf_counter() - t)"
+        )
+
+    results = {}
+    for name, code in cases.items():
+        samples = []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", code], cwd=module_dir,
+                                 capture_output=True, text=True, check=True)
+            samples.append(float(out.stdout.strip().splitlines()[-1]))
+        results[name] = sorted(samples)[len(samples) // 2]
+        print(f"{name}: {results[name] * 1000:.1f} ms")
+    return results
 
 # Esquema para la tabla info_detalle simplificada:
 # id_original (STRING), titulo (STRING), analisis (STRING)
@@ -182,10 +2869,47 @@ CREATE OR REPLACE TABLE `website-401719.db_informacion.info_detalle` (
 
 # Agregar este código para ejecutar localmente
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Análisis de etiquetas de banano con Gemini")
+    parser.add_argument("--full-rebuild", action="store_true",
+                        help="Borra y recrea info_detalle y vuelve a analizar todos los registros")
+    parser.add_argument("--benchmark-startup", action="store_true",
+                        help="Mide el tiempo de import y de la primera llamada al modelo y termina")
+    parser.add_argument("--shard-index", type=int, default=SHARD_INDEX,
+                        help="Fragmento a procesar (por defecto CLOUD_RUN_TASK_INDEX o 0)")
+    parser.add_argument("--shard-count", type=int, default=SHARD_COUNT,
+                        help="Número de fragmentos (por defecto CLOUD_RUN_TASK_COUNT o 1)")
+    parser.add_argument("--work-queue", action="store_true",
+                        help="Reparte el trabajo con la cola de arrendamientos en WORK_QUEUE_FILE")
+    parser.add_argument("--queue-workers", type=int, default=WORK_QUEUE_WORKERS,
+                        help="Procesos de esta máquina que comparten la cola y la cuota")
+    parser.add_argument("--metrics-file", default=METRICS_FILE,
+                        help="Exporta las métricas de la ejecución a este archivo")
+    parser.add_argument("--metrics-format", choices=["json", "prometheus", "openmetrics"], default=METRICS_FORMAT,
+                        help="Formato de --metrics-file")
+    parser.add_argument("--tracing", choices=["otlp", "file"], default=TRACING_EXPORTER,
+                        help="Exporta trazas de OpenTelemetry a un colector OTLP o a TRACING_FILE")
+    parser.add_argument("--time-budget", type=float, default=TIME_BUDGET_SECONDS,
+                        help="Segundos por invocación; las continuaciones se ejecutan en este proceso")
+    args = parser.parse_args()
+
+    if args.benchmark_startup:
+        benchmark_startup(model_call=True)
+        sys.exit(0)
+
     print("Iniciando análisis de etiquetas...")
     print("\nVerificando recursos de BigQuery...")
     try:
-        analyze_banana_labels(None, None)
+        trigger = LocalContinuationTrigger()
+        analyze_banana_labels(None, None, full_rebuild=args.full_rebuild or FULL_REBUILD,
+                              time_budget=args.time_budget, continuation_trigger=trigger,
+                              shard_index=args.shard_index, shard_count=args.shard_count,
+                              work_queue=WorkQueue(workers=args.queue_workers) if args.work_queue else None,
+                              metrics_file=args.metrics_file, metrics_format=args.metrics_format,
+                              tracing=args.tracing)
+        trigger.run_pending(time_budget=args.time_budget,
+                            work_queue=WorkQueue(workers=args.queue_workers) if args.work_queue else None,
+                            metrics_file=args.metrics_file, metrics_format=args.metrics_format,
+                            tracing=args.tracing)
         print("\nAnálisis completado exitosamente.")
     except Exception as e:
         print(f"\nError durante la ejecución: {str(e)}")
@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+
+# infoia.py es un módulo suelto en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import infoia
+import infoia_local
+
+
+@pytest.fixture(autouse=True)
+def unlimited_quota(monkeypatch):
+    """Las pruebas no esperan a la cuota real de Vertex AI"""
+    monkeypatch.setattr(infoia, "VERTEX_REQUESTS_PER_MINUTE", 10 ** 9)
+    monkeypatch.setattr(infoia, "VERTEX_TOKENS_PER_MINUTE", 10 ** 12)
+    monkeypatch.setattr(infoia, "rate_limiter", infoia.RateLimiter(10 ** 9, 10 ** 12))
+    monkeypatch.setattr(infoia, "_rate_limiter_share", 1)
+
+
+@pytest.fixture(autouse=True)
+def restore_backends(monkeypatch):
+    """Los clientes que instale una prueba (p. ej. run_local_shard) no pasan a la siguiente"""
+    monkeypatch.setattr(infoia, "_bq_client", infoia._bq_client)
+    monkeypatch.setattr(infoia, "_resources_verified_at", infoia._resources_verified_at)
+
+
+@pytest.fixture
+def fake_bigquery(monkeypatch):
+    """Instala un FakeBigQueryClient con `rows` y omite la verificación de recursos"""
+    def install(rows):
+        client = infoia_local.FakeBigQueryClient(rows)
+        monkeypatch.setattr(infoia, "_bq_client", client)
+        monkeypatch.setattr(infoia, "_resources_verified_at", time.monotonic())
+        return client
+    return install
@@ -0,0 +1,58 @@
+import collections
+
+import pytest
+
+import infoia
+import infoia_local
+
+
+class RecordingModel(infoia_local.FakeGenerativeModel):
+    def __init__(self):
+        super().__init__()
+        self.prompts = []
+
+    def generate_content(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return super().generate_content(prompt, **kwargs)
+
+
+class NeverEndingJob:
+    state = "JOB_STATE_RUNNING"
+    has_ended = False
+
+    def __init__(self):
+        self.refreshes = 0
+
+    def refresh(self):
+        self.refreshes += 1
+
+
+def test_failed_batch_rows_fall_back_to_online(tmp_path, monkeypatch, fake_bigquery):
+    monkeypatch.setattr(infoia, "CHECKPOINT_FILE", str(tmp_path / "checkpoint.ndjson"))
+    rows = [{"Id": i, "Titulo": f"titulo-{i}-fin", "Comentario": f"c{i}"} for i in range(50)]
+    client = fake_bigquery(rows)
+    runner = infoia_local.LocalBatchJobRunner(RecordingModel(), fail_ids={"3", "17", "42"})
+    online_model = RecordingModel()
+
+    infoia.analyze_banana_labels(None, None, output_backend="streaming", input_reader="rest", use_cache=False,
+                                 deduplicate=False, generation_mode="batch", batch_runner=runner,
+                                 model=online_model)
+
+    assert len(runner.model.prompts) == 47
+    assert sorted(prompt.split("titulo-")[1].split("-fin")[0] for prompt in online_model.prompts) == ["17", "3", "42"]
+    counts = collections.Counter(row["id_original"] for row in client.inserted)
+    assert counts == collections.Counter(str(i) for i in range(50))
+    # El job simulado termina en la tercera consulta: esperas de 30 y 60 s
+    assert runner.clock.now() == pytest.approx(90.0)
+
+
+def test_batch_poll_backoff_stops_at_deadline():
+    clock = infoia.FakeClock()
+    job = NeverEndingJob()
+
+    with pytest.raises(Exception, match="no terminó en 1000"):
+        infoia.wait_for_batch_job(job, clock, initial_delay=30, max_delay=300, timeout=1000)
+
+    # Esperas de 30, 60, 120, 240 y 300 s; la siguiente pasaría del plazo
+    assert clock.now() == pytest.approx(750.0)
+    assert job.refreshes == 6
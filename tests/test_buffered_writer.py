@@ -0,0 +1,28 @@
+import threading
+import time
+
+import infoia
+
+
+def slow_insert(table_ref, rows):
+    time.sleep(0.05)
+    return None
+
+
+def test_write_does_not_deadlock_when_queue_is_full():
+    """Con la cola de lotes llena, write() y close() deben terminar (antes se bloqueaban)"""
+    writer = infoia.BufferedWriter("t", max_rows=1, insert=slow_insert)
+    rows = [{"id_original": str(i), "titulo": "t", "analisis": "a"} for i in range(50)]
+
+    def produce():
+        for row in rows:
+            writer.write(row)
+        writer.close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    producer.join(timeout=30)
+
+    assert not producer.is_alive(), "write()/close() quedaron bloqueados"
+    assert writer.rows_written == 50
+    assert writer.batches_written == 50
@@ -0,0 +1,80 @@
+import collections
+
+import pytest
+
+import infoia
+import infoia_local
+
+
+class Killed(Exception):
+    pass
+
+
+class DyingModel(infoia_local.FakeGenerativeModel):
+    """Modelo que falla en la llamada `die_at`, como un proceso que se cae a mitad de ejecución"""
+
+    def __init__(self, die_at=None):
+        super().__init__()
+        self.die_at = die_at
+        self.calls = 0
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        if self.calls == self.die_at:
+            raise Killed("proceso terminado")
+        return super().generate_content(prompt, **kwargs)
+
+
+def run(model):
+    return infoia.analyze_banana_labels(None, None, output_backend="streaming", input_reader="rest",
+                                        use_cache=False, deduplicate=False, max_concurrency=4, model=model)
+
+
+def test_resume_after_kill_writes_each_row_once(tmp_path, monkeypatch, fake_bigquery):
+    monkeypatch.setattr(infoia, "CHECKPOINT_FILE", str(tmp_path / "checkpoint.ndjson"))
+    rows = [{"Id": i, "Titulo": f"t{i}", "Comentario": f"c{i}"} for i in range(100)]
+    client = fake_bigquery(rows)
+
+    with pytest.raises(Killed):
+        run(DyingModel(die_at=60))
+    written_before_kill = len(client.inserted)
+    assert 0 < written_before_kill < 100
+
+    journal = infoia.CheckpointJournal(infoia.CHECKPOINT_FILE)
+    assert journal.resumed
+    assert len(journal.completed) == written_before_kill
+
+    resumed_model = DyingModel()
+    run(resumed_model)
+
+    counts = collections.Counter(row["id_original"] for row in client.inserted)
+    assert counts == collections.Counter(str(i) for i in range(100))
+    assert resumed_model.calls == 100 - written_before_kill
+    assert not infoia.CheckpointJournal(infoia.CHECKPOINT_FILE).resumed
+
+
+def test_full_rebuild_discards_journal_of_crashed_incremental_run(tmp_path, monkeypatch, fake_bigquery):
+    monkeypatch.setattr(infoia, "CHECKPOINT_FILE", str(tmp_path / "checkpoint.ndjson"))
+    rows = [{"Id": i, "Titulo": f"t{i}", "Comentario": f"c{i}"} for i in range(100)]
+    client = fake_bigquery(rows)
+    with pytest.raises(Killed):
+        run(DyingModel(die_at=30))
+    assert infoia.CheckpointJournal(infoia.CHECKPOINT_FILE).resumed
+
+    verified_modes = []
+
+    def verify(full_rebuild):
+        verified_modes.append(full_rebuild)
+        if full_rebuild:
+            client.inserted.clear()  # La tabla se recrea vacía
+        return True
+
+    monkeypatch.setattr(infoia, "verify_bigquery_resources", verify)
+    model = DyingModel()
+    infoia.analyze_banana_labels(None, None, output_backend="streaming", input_reader="rest", use_cache=False,
+                                 deduplicate=False, max_concurrency=4, model=model, full_rebuild=True)
+
+    assert verified_modes == [True]
+    assert model.calls == 100
+    counts = collections.Counter(row["id_original"] for row in client.inserted)
+    assert counts == collections.Counter(str(i) for i in range(100))
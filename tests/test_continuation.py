@@ -0,0 +1,63 @@
+import base64
+import collections
+
+import pytest
+
+import infoia
+import infoia_local
+
+
+class ClockedModel(infoia_local.FakeGenerativeModel):
+    """Modelo que hace avanzar un FakeClock en cada llamada"""
+
+    def __init__(self, clock, seconds_per_call):
+        super().__init__()
+        self.clock = clock
+        self.seconds_per_call = seconds_per_call
+
+    def generate_content(self, prompt, **kwargs):
+        self.clock.advance(self.seconds_per_call)
+        return super().generate_content(prompt, **kwargs)
+
+
+def test_continuations_write_each_row_once(tmp_path, monkeypatch, fake_bigquery):
+    monkeypatch.setattr(infoia, "CHECKPOINT_FILE", str(tmp_path / "checkpoint.ndjson"))
+    rows = [{"Id": i, "Titulo": f"t{i}", "Comentario": f"c{i}"} for i in range(100)]
+    client = fake_bigquery(rows)
+    clock = infoia.FakeClock()
+    trigger = infoia.LocalContinuationTrigger()
+    options = dict(output_backend="streaming", input_reader="rest", use_cache=False, deduplicate=False,
+                   max_concurrency=2, model=ClockedModel(clock, 10.0), clock=clock, time_budget=300)
+
+    token = infoia.analyze_banana_labels(None, None, continuation_trigger=trigger, **options)
+    assert token is not None
+    assert 0 < len(client.inserted) < 100
+
+    trigger.run_pending(**options)
+
+    assert trigger.delivered >= 2
+    counts = collections.Counter(row["id_original"] for row in client.inserted)
+    assert counts == collections.Counter(str(i) for i in range(100))
+
+
+def encode(payload):
+    return {"data": base64.b64encode(payload).decode("ascii")}
+
+
+@pytest.mark.parametrize("event", [
+    None,
+    {},
+    {"data": ""},
+    {"data": "no es base64!"},
+    encode(b"texto plano"),
+    encode(b"\xff\xfe"),
+    encode(b"[1, 2]"),
+    encode(b'{"mensaje": "otro"}'),
+])
+def test_non_token_payloads_are_ignored(event):
+    assert infoia.decode_continuation_token(event) is None
+
+
+def test_continuation_token_round_trip():
+    token = {"continuation": 2, "run_id": "r1", "rows_written": 40}
+    assert infoia.decode_continuation_token(infoia.encode_continuation_event(token)) == token
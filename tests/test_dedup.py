@@ -0,0 +1,47 @@
+import random
+
+import infoia
+
+
+def row(i, comentario):
+    return {"Id": i, "Titulo": "Etiqueta", "Comentario": comentario}
+
+
+def test_lsh_index_is_bounded_by_cached_results():
+    dedup = infoia.InputDeduplicator(max_results=5, lsh=infoia.MinHashLSH(0.8))
+    for i in range(100):
+        key, analysis, representative = dedup.add(row(i, f"comentario único número {i} " * 3 + str(i * 7919)))
+        assert representative
+        dedup.complete(key, f"análisis {i}")
+
+    assert len(dedup.lsh._signatures) == len(dedup.lsh._shingles) == 5
+    assert sum(len(bucket) for bucket in dedup.lsh._buckets) <= 5 * dedup.lsh.bands
+
+
+def test_near_duplicate_of_cached_result_is_reused():
+    dedup = infoia.InputDeduplicator(max_results=5, lsh=infoia.MinHashLSH(0.8))
+    key, _, _ = dedup.add(row(1, "la fruta llegó con manchas negras en la cáscara y el racimo dañado"))
+    dedup.complete(key, "análisis")
+
+    _, analysis, representative = dedup.add(row(2, "la fruta llegó con manchas negras en la cáscara y el racimo dañado!"))
+
+    assert not representative
+    assert analysis == "análisis"
+
+
+def test_lsh_recall_against_exact_pairs():
+    # Comentarios que solo cambian en el lote y la fecha, mezclados con otros distintos
+    rng = random.Random(7)
+    bases = ["Etiqueta ilegible por el lector en el puerto de Tokio, la tinta se corrió sobre el código de barras",
+             "El código QR aparece borroso en cajas del contenedor y el lector no reconoce la trazabilidad",
+             "Impresión desalineada, el código de barras queda cortado en el borde de la etiqueta de la caja"]
+    texts = []
+    for i in range(150):
+        base = rng.choice(bases) if i % 3 else f"Observación distinta {i} de la finca {rng.randrange(999)}"
+        texts.append(f"{base}. Lote {rng.randrange(10000)} fecha {rng.randrange(1, 29)}/{rng.randrange(1, 13)}/2024")
+
+    for threshold in (0.7, 0.8, 0.85):
+        result = infoia.evaluate_lsh_recall(texts, threshold)
+        assert result["pairs_exact"] > 0
+        assert result["recall"] >= 0.95
+        assert result["precision"] == 1.0
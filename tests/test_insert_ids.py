@@ -0,0 +1,48 @@
+import collections
+
+import infoia
+import infoia_local
+
+
+class TimeoutAfterCommitClient(infoia_local.FakeBigQueryClient):
+    """Guarda las filas y falla en la primera llamada, como un timeout tras el commit"""
+
+    def __init__(self):
+        super().__init__([])
+        self.calls = []
+
+    def insert_rows_json(self, table, rows, row_ids=None, **kwargs):
+        self.calls.append(list(row_ids))
+        self.inserted.extend(dict(row, insert_id=insert_id) for row, insert_id in zip(rows, row_ids))
+        if len(self.calls) == 1:
+            raise TimeoutError("se agotó el tiempo de espera de la respuesta")
+        return []
+
+
+def test_retry_after_commit_reuses_insert_ids(monkeypatch):
+    client = TimeoutAfterCommitClient()
+    monkeypatch.setattr(infoia, "_bq_client", client)
+    monkeypatch.setattr(infoia, "insert_backoff_delay", lambda attempt: 0)
+    rows = [{"id_original": str(i), "titulo": f"t{i}", "analisis": "a"} for i in range(10)]
+
+    assert infoia.insert_with_retry("t", rows) is None
+
+    assert len(client.calls) == 2
+    assert client.calls[0] == client.calls[1]
+    # BigQuery descarta las filas repetidas con el mismo insertId
+    deduplicated = {row["insert_id"]: row for row in client.inserted}.values()
+    counts = collections.Counter(row["id_original"] for row in deduplicated)
+    assert counts == collections.Counter(row["id_original"] for row in rows)
+
+
+def test_prompt_version_is_computed_once(monkeypatch):
+    infoia.prompt_version.cache_clear()
+    renders = []
+    build_prompt = infoia.build_prompt
+    monkeypatch.setattr(infoia, "build_prompt", lambda *args: renders.append(args) or build_prompt(*args))
+
+    ids = {infoia.make_insert_id(str(i)) for i in range(100)}
+
+    assert len(ids) == 100
+    assert len(renders) == 1
+    infoia.prompt_version.cache_clear()
@@ -0,0 +1,92 @@
+import pytest
+
+import infoia
+
+
+class ScriptedClient:
+    """Responde cada insert_rows_json con el siguiente elemento de `script` (errores o excepción)"""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = []
+
+    def insert_rows_json(self, table, rows, row_ids=None, **kwargs):
+        self.calls.append([row["id_original"] for row in rows])
+        result = self.script.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class MemorySink:
+    def __init__(self):
+        self.rows = []
+
+    def write(self, row, errors):
+        self.rows.append((row["id_original"], [error["reason"] for error in errors]))
+
+
+def row_error(index, reason):
+    return {"index": index, "errors": [{"reason": reason, "message": reason}]}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(infoia, "insert_backoff_delay", lambda attempt: 0.5 * (attempt + 1))
+    monkeypatch.setattr(infoia.time, "sleep", recorded.append)
+    return recorded
+
+
+def rows(count):
+    return [{"id_original": str(i), "titulo": f"t{i}", "analisis": "a"} for i in range(count)]
+
+
+def test_only_failed_rows_are_resent(monkeypatch, sleeps):
+    client = ScriptedClient([[row_error(1, "backendError"), row_error(3, "stopped")], []])
+    monkeypatch.setattr(infoia, "_bq_client", client)
+    sink = MemorySink()
+
+    assert infoia.insert_with_retry("t", rows(5), dead_letter=sink) is None
+
+    assert client.calls == [["0", "1", "2", "3", "4"], ["1", "3"]]
+    assert sleeps == [0.5]
+    assert sink.rows == []
+
+
+def test_invalid_rows_go_straight_to_dead_letter(monkeypatch, sleeps):
+    client = ScriptedClient([[row_error(0, "invalid"), row_error(2, "backendError")], []])
+    monkeypatch.setattr(infoia, "_bq_client", client)
+    sink = MemorySink()
+
+    rejected = infoia.insert_with_retry("t", rows(3), dead_letter=sink)
+
+    assert client.calls == [["0", "1", "2"], ["2"]]
+    assert [entry["index"] for entry in rejected] == [0]
+    assert sink.rows == [("0", ["invalid"])]
+
+
+def test_rows_still_failing_after_last_attempt_are_dead_lettered(monkeypatch, sleeps):
+    client = ScriptedClient([[row_error(0, "backendError")]] * 3)
+    monkeypatch.setattr(infoia, "_bq_client", client)
+    sink = MemorySink()
+
+    rejected = infoia.insert_with_retry("t", rows(2), max_retries=3, dead_letter=sink)
+
+    assert client.calls == [["0", "1"], ["0"], ["0"]]
+    assert sleeps == [0.5, 1.0]
+    assert [entry["index"] for entry in rejected] == [0]
+    assert sink.rows == [("0", ["backendError"])]
+
+
+def test_rejected_rows_are_dead_lettered_when_last_attempt_raises(monkeypatch, sleeps):
+    client = ScriptedClient([[row_error(1, "invalid"), row_error(2, "backendError")],
+                             ConnectionError("conexión perdida")])
+    monkeypatch.setattr(infoia, "_bq_client", client)
+    sink = MemorySink()
+
+    with pytest.raises(ConnectionError):
+        infoia.insert_with_retry("t", rows(3), max_retries=2, dead_letter=sink)
+
+    assert client.calls == [["0", "1", "2"], ["2"]]
+    assert sink.rows == [("1", ["invalid"])]
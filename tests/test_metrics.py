@@ -0,0 +1,21 @@
+import infoia
+
+
+def test_aimd_window_and_adjustments_are_exported():
+    infoia.metrics.reset()
+    controller = infoia.AdaptiveConcurrencyController(initial=8, min_limit=1, max_limit=16,
+                                                      clock=infoia.FakeClock())
+    assert infoia.metrics.gauges["concurrency_window"] == 8
+
+    controller.acquire()
+    controller.release(1.0, "throttled")
+
+    summary = infoia.metrics.summary()
+    assert summary["gauges"]["concurrency_window"] == controller.window < 8
+    assert summary["counters"]["concurrency_adjustments"] == 1
+
+    text = infoia.metrics.to_prometheus()
+    assert "# TYPE infoia_concurrency_window gauge" in text
+    assert f"infoia_concurrency_window {controller.window}" in text
+    assert "infoia_concurrency_adjustments_total 1" in text
+    infoia.metrics.reset()
@@ -0,0 +1,59 @@
+import json
+
+import infoia
+
+
+def response(text):
+    return type("Response", (), {"text": text, "candidates": [], "usage_metadata": None})()
+
+
+class PackModel:
+    """Responde los paquetes con un arreglo JSON sin el Id `missing_id` y los registros sueltos con texto"""
+
+    def __init__(self, missing_id):
+        self.missing_id = missing_id
+        self.single_prompts = []
+
+    def generate_content(self, prompt, **kwargs):
+        if "arreglo JSON" in prompt:
+            ids = [line.split("[Id]:")[1].strip() for line in prompt.splitlines() if "[Id]:" in line]
+            items = [{"id": i, "analisis": f"paquete {i}"} for i in ids if i != self.missing_id]
+            return response("```json\n" + json.dumps(items) + "\n```")
+        self.single_prompts.append(prompt)
+        return response("individual")
+
+
+def test_parse_accepts_code_fences_and_surrounding_text():
+    text = 'Aquí está:\n```json\n[{"id": "1", "analisis": " uno "}, {"id": 2, "analisis": "dos"}]\n```'
+    assert infoia.parse_packed_response(text, ["1", "2"]) == {"1": "uno", "2": "dos"}
+
+
+def test_parse_drops_unknown_duplicate_and_invalid_entries():
+    items = [
+        {"id": "1", "analisis": "primero"},
+        {"id": "1", "analisis": "repetido"},
+        {"id": "9", "analisis": "desconocido"},
+        {"id": "2", "analisis": 42},
+        {"id": "3", "analisis": "   "},
+        {"analisis": "sin id"},
+        "no es un objeto",
+    ]
+    assert infoia.parse_packed_response(json.dumps(items), ["1", "2", "3"]) == {"1": "primero"}
+
+
+def test_parse_rejects_non_arrays_and_broken_json():
+    assert infoia.parse_packed_response("sin JSON", ["1"]) == {}
+    assert infoia.parse_packed_response('[{"id": "1", "analisis": "a"', ["1"]) == {}
+    assert infoia.parse_packed_response('{"id": "1", "analisis": "a"}', ["1"]) == {}
+
+
+def test_missing_record_falls_back_to_single_call():
+    rows = [{"Id": i, "Titulo": f"t{i}", "Comentario": f"c{i}"} for i in range(1, 5)]
+    model = PackModel(missing_id="3")
+
+    output_rows = infoia.analyze_pack(model, rows)
+
+    assert [row["id_original"] for row in output_rows] == ["1", "2", "3", "4"]
+    assert [row["analisis"] for row in output_rows] == ["paquete 1", "paquete 2", "individual", "paquete 4"]
+    assert len(model.single_prompts) == 1
+    assert "[Titulo]: t3" in model.single_prompts[0]
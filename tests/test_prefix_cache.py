@@ -0,0 +1,52 @@
+import pytest
+
+import infoia
+
+
+class InvalidArgument(Exception):
+    code = 400
+
+
+class NotFound(Exception):
+    code = 404
+
+
+class FailingModel:
+    def __init__(self, error):
+        self.error = error
+
+    def generate_content(self, prompt, **kwargs):
+        raise self.error
+
+
+class EchoModel:
+    def generate_content(self, prompt, **kwargs):
+        return type("Response", (), {"text": prompt, "candidates": [], "usage_metadata": None})()
+
+
+def prefixed(error):
+    return infoia.PrefixCachedModel(EchoModel(), FailingModel(error), "PREFIJO ", "cached_content")
+
+
+@pytest.mark.parametrize("error", [
+    NotFound("CachedContent not found"),
+    InvalidArgument("cached_content has expired"),
+    InvalidArgument("system_instruction is not supported by this model"),
+])
+def test_prefix_errors_switch_to_full_prompts(error):
+    model = prefixed(error)
+
+    assert model.generate_content("PREFIJO registro").text == "PREFIJO registro"
+    assert model.mode == "full"
+
+
+@pytest.mark.parametrize("error", [
+    InvalidArgument("Request contains an invalid argument: unsupported character in contents"),
+    ValueError("respuesta inesperada"),
+])
+def test_other_errors_keep_the_prefix(error):
+    model = prefixed(error)
+
+    with pytest.raises(type(error)):
+        model.generate_content("PREFIJO registro")
+    assert model.mode == "cached_content"
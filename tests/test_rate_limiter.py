@@ -0,0 +1,60 @@
+import pytest
+
+import infoia
+
+
+def test_request_budget_paces_acquires():
+    clock = infoia.FakeClock()
+    limiter = infoia.RateLimiter(60, 10 ** 9, clock=clock)
+
+    for _ in range(120):
+        limiter.acquire()
+
+    # Las 60 primeras usan la cubeta llena; las otras 60 esperan 1 s cada una
+    assert clock.now() == pytest.approx(60.0)
+
+
+def test_token_budget_paces_acquires():
+    clock = infoia.FakeClock()
+    limiter = infoia.RateLimiter(10 ** 6, 6000, clock=clock)
+
+    for _ in range(4):
+        limiter.acquire(tokens=3000)
+
+    # 6000 tokens de entrada y luego 3000 cada 30 s
+    assert clock.now() == pytest.approx(60.0)
+
+
+def test_record_usage_refunds_overestimate():
+    clock = infoia.FakeClock()
+    limiter = infoia.RateLimiter(10 ** 6, 6000, clock=clock)
+
+    limiter.acquire(tokens=6000)
+    limiter.record_usage(reserved_tokens=6000, actual_tokens=1000)
+    limiter.acquire(tokens=5000)
+
+    assert clock.now() == 0.0
+
+
+def test_record_usage_underestimate_becomes_debt():
+    clock = infoia.FakeClock()
+    limiter = infoia.RateLimiter(10 ** 6, 6000, clock=clock)
+
+    limiter.acquire(tokens=1000)
+    limiter.record_usage(reserved_tokens=1000, actual_tokens=12000)
+    assert limiter.tokens.tokens == pytest.approx(-6000)
+
+    limiter.acquire(tokens=1000)
+
+    # Se paga la deuda (6000) y la nueva reserva (1000) a 100 tokens/s
+    assert clock.now() == pytest.approx(70.0)
+
+
+def test_reservation_larger_than_budget_waits_for_full_bucket():
+    clock = infoia.FakeClock()
+    limiter = infoia.RateLimiter(10 ** 6, 6000, clock=clock)
+
+    limiter.acquire(tokens=6000)
+    limiter.acquire(tokens=10 ** 6)
+
+    assert clock.now() == pytest.approx(60.0)
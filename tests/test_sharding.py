@@ -0,0 +1,18 @@
+import infoia
+import infoia_local
+
+
+def test_shards_split_rows_without_overlap():
+    rows = [{"Id": i, "Titulo": f"t{i}", "Comentario": f"c{i}"} for i in range(60)]
+    saved = [infoia_local.run_local_shard(i, 3, rows) for i in range(3)]
+
+    ids = [id_original for shard in saved for id_original in shard]
+    assert sorted(ids) == sorted(str(i) for i in range(60))
+
+
+def test_unsharded_run_restores_full_quota():
+    infoia.share_quota(4)
+    quartered = infoia.rate_limiter.requests.capacity
+    infoia.share_quota(1)
+
+    assert infoia.rate_limiter.requests.capacity == quartered * 4
@@ -0,0 +1,32 @@
+import os
+
+import infoia
+import infoia_local
+
+
+def test_queue_workers_skip_journal_and_share_quota(tmp_path, monkeypatch):
+    monkeypatch.setattr(infoia, "CHECKPOINT_FILE", str(tmp_path / "checkpoint.ndjson"))
+    rows = [{"Id": i, "Titulo": f"t{i}", "Comentario": f"c{i}"} for i in range(20)]
+    queue_path = str(tmp_path / "work_queue.sqlite3")
+
+    saved = infoia_local.run_local_worker(queue_path, rows, workers=3)
+
+    assert saved == sorted(str(i) for i in range(20))
+    # El estado done de la cola sustituye al diario compartido
+    assert not any(name.startswith("checkpoint") for name in os.listdir(tmp_path))
+    assert infoia._rate_limiter_share == 3
+
+
+def test_queue_worker_ignores_shard_settings(tmp_path, fake_bigquery):
+    rows = [{"Id": i, "Titulo": f"t{i}", "Comentario": f"c{i}"} for i in range(30)]
+    queue_path = str(tmp_path / "work_queue.sqlite3")
+    client = fake_bigquery(rows)
+    work_queue = infoia.WorkQueue(queue_path, poll_seconds=0.1, workers=2)
+
+    # Como en un Cloud Run job con CLOUD_RUN_TASK_COUNT=3
+    infoia.analyze_banana_labels(None, None, output_backend="streaming", input_reader="rest", use_cache=False,
+                                 shard_index=1, shard_count=3, work_queue=work_queue,
+                                 model=infoia_local.FakeGenerativeModel())
+
+    assert sorted(row["id_original"] for row in client.inserted) == sorted(str(i) for i in range(30))
+    assert infoia._rate_limiter_share == 2